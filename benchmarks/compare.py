@@ -0,0 +1,45 @@
+""" Compare two benchmark results files written by run.py
+
+    python benchmarks/compare.py baseline.json results.json
+"""
+import argparse
+import json
+from typing import Dict, Tuple
+
+
+def _key(result: Dict) -> Tuple[str, str]:
+    params = {k: v for k, v in result['params'].items() if k in ('workers', 'engine')}
+    return result['name'], json.dumps(params, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two Lil Pwny benchmark results files')
+    parser.add_argument('baseline', help='Results file to compare against')
+    parser.add_argument('results', help='New results file')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+
+    if baseline['corpus'] != results['corpus']:
+        print('Warning: the results were run against different corpora')
+
+    baseline_results = {_key(result): result for result in baseline['results']}
+    print(f'{"benchmark":<18} {"params":<36} {"baseline":>12} {"new":>12} {"speedup":>8} {"peak RSS":>10}')
+    for result in results['results']:
+        name, params = _key(result)
+        old = baseline_results.get((name, params))
+        if old is None or not old['throughput'] or not result['throughput']:
+            continue
+        speedup = result['throughput'] / old['throughput']
+        rss_change = ''
+        if old['peak_rss_kb'] and result['peak_rss_kb']:
+            rss_change = f'{(result["peak_rss_kb"] - old["peak_rss_kb"]) / old["peak_rss_kb"]:+.0%}'
+        print(f'{name:<18} {params:<36} {old["throughput"]:>12,.0f} {result["throughput"]:>12,.0f}'
+              f' {speedup:>7.2f}x {rss_change:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import math
+import os
+import random
+from typing import List
+
+from lil_pwny.hashing import ntlm_digests
+
+HASH_SPACE = 2 ** 128
+CUSTOM_WORDS = ['summer', 'winter', 'spring', 'autumn', 'password', 'welcome', 'company', 'london', 'dragon',
+                'monkey', 'football', 'letmein', 'sunshine', 'princess', 'shadow', 'master', 'qwerty', 'baseball']
+
+
+def _hibp_hash(index: int, count: int, seed: int) -> str:
+    """ The hash on line `index` of a sorted synthetic HIBP file. Hashes are spread evenly over the hash space with
+    a pseudorandom offset, so line `index` can be generated without generating the lines before it
+
+    Args:
+        index: position of the hash in the sorted file
+        count: number of hashes in the file
+        seed: seed of the corpus
+    Returns:
+        32 character uppercase hex hash
+    """
+
+    step = HASH_SPACE // count
+    jitter = int.from_bytes(hashlib.md5(f'{seed}:{index}'.encode('utf-8')).digest(), 'big') % step
+    return f'{index * step + jitter:032X}'
+
+
+def _hibp_count(index: int, seed: int) -> int:
+    """ Pseudorandom occurrence count for a hash, skewed towards small counts like the real HIBP file
+    """
+
+    value = int.from_bytes(hashlib.md5(f'count:{seed}:{index}'.encode('utf-8')).digest()[:4], 'big')
+    return 1 + int(math.exp((value / 0xFFFFFFFF) * 12))
+
+
+def _permute(index: int, count: int, seed: int) -> int:
+    """ Map a position to a unique position in range(count), so an unsorted file can be written one line at a time
+    """
+
+    multiplier = 2 * (seed % 1000) + 1000003
+    while math.gcd(multiplier, count) != 1:
+        multiplier += 2
+    return (index * multiplier + seed) % count
+
+
+def write_hibp(filepath: str, count: int, ordered: bool = True, seed: int = 0, line_ending: str = '\n') -> str:
+    """ Write a synthetic HIBP file of "hash:occurrences" lines
+
+    Args:
+        filepath: path to write the file to
+        count: number of hashes in the file
+        ordered: write the hashes in hash order, like the "ordered by hash" HIBP download
+        seed: seed of the corpus. The same seed and count always produce the same hashes
+        line_ending: line ending to use. The HIBP downloader writes CRLF
+    Returns:
+        Path of the file
+    """
+
+    with open(filepath, 'w', newline='') as f:
+        for position in range(count):
+            index = position if ordered else _permute(position, count, seed)
+            f.write(f'{_hibp_hash(index, count, seed)}:{_hibp_count(index, seed)}{line_ending}')
+    return filepath
+
+
+def write_custom(filepath: str, count: int, seed: int = 0) -> List[str]:
+    """ Write a synthetic custom password list
+
+    Args:
+        filepath: path to write the file to
+        count: number of custom passwords
+        seed: seed of the corpus
+    Returns:
+        The custom passwords
+    """
+
+    rng = random.Random(f'custom:{seed}')
+    passwords = [CUSTOM_WORDS[i] if i < len(CUSTOM_WORDS) else f'{rng.choice(CUSTOM_WORDS)}{i}'
+                 for i in range(count)]
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(passwords) + '\n')
+    return passwords
+
+
+def write_ad(filepath: str,
+             users: int,
+             hibp_count: int,
+             hibp_hit_rate: float = 0.1,
+             username_hit_rate: float = 0.01,
+             custom_passwords: List[str] = None,
+             custom_hit_rate: float = 0.01,
+             seed: int = 0) -> dict:
+    """ Write a synthetic AD user file of "username:hash" lines with a controlled rate of each type of finding
+
+    Args:
+        filepath: path to write the file to
+        users: number of users
+        hibp_count: number of hashes in the synthetic HIBP file generated with the same seed
+        hibp_hit_rate: fraction of users whose hash is in the HIBP file
+        username_hit_rate: fraction of users whose password is their username in uppercase
+        custom_passwords: custom passwords whose variants users can have as their password
+        custom_hit_rate: fraction of users whose password is a custom password with a year and `!` appended
+        seed: seed of the corpus
+    Returns:
+        Dict of the number of users with each type of finding
+    """
+
+    rng = random.Random(f'ad:{seed}')
+    hits = {'hibp': 0, 'username': 0, 'custom': 0}
+    with open(filepath, 'w') as f:
+        for user in range(users):
+            username = f'first{user}.last{user % 997}'
+            roll = rng.random()
+            if roll < hibp_hit_rate:
+                ntlm_hash = _hibp_hash(rng.randrange(hibp_count), hibp_count, seed)
+                hits['hibp'] += 1
+            elif roll < hibp_hit_rate + username_hit_rate:
+                ntlm_hash = ntlm_digests([username.upper()]).hex().upper()
+                hits['username'] += 1
+            elif custom_passwords and roll < hibp_hit_rate + username_hit_rate + custom_hit_rate:
+                password = f'{rng.choice(custom_passwords).capitalize()}{rng.randrange(1950, 2020)}!'
+                ntlm_hash = ntlm_digests([password]).hex().upper()
+                hits['custom'] += 1
+            else:
+                # Random hashes are almost certainly not in the HIBP file
+                ntlm_hash = f'{rng.getrandbits(128):032X}'
+            f.write(f'{username}:{ntlm_hash}\n')
+    return hits
+
+
+def file_size_mb(filepath: str) -> float:
+    return os.path.getsize(filepath) / (1024 * 1024)
@@ -0,0 +1,277 @@
+""" Benchmarks for Lil Pwny, run against deterministic synthetic corpora.
+
+Each benchmark runs in its own Python process, so its peak RSS is measured separately. Results are written as JSON,
+and two results files can be compared with compare.py.
+
+    python benchmarks/run.py --hibp-lines 1000000 --ad-users 10000 --workers 1,2,4 --out results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+from typing import Callable, Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import lil_pwny
+from lil_pwny import numpy_matcher, password_audit
+from lil_pwny.hashing import HASH_BATCH_SIZE, Hashing, HashingEngine
+from lil_pwny.loggers import JSONLogger
+from lil_pwny.variant_generators.custom_variant_generator import CustomVariantGenerator
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import corpus  # noqa: E402
+
+# Smaller than the default block size of the CLI, so the corpus is split into enough blocks to measure core scaling
+DEFAULT_BLOCK_SIZE = 8
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str) -> Callable:
+    """ Register a benchmark function. Each function takes the corpus and the benchmark parameters and returns the
+    number of items it processed and the unit they are counted in
+    """
+
+    def register(function: Callable) -> Callable:
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _quiet_logger():
+    return JSONLogger(stream=io.StringIO())
+
+
+@benchmark('import_users')
+def _import_users(files: Dict, params: Dict):
+    users = password_audit.import_users(files['ad'])
+    return sum(len(usernames) for usernames in users.values()), 'lines'
+
+
+@benchmark('divide_blocks')
+def _divide_blocks(files: Dict, params: Dict):
+    password_audit._divide_blocks(files['hibp_unsorted'], 1024 * 1024 * params['block_size'], 0)
+    return corpus.file_size_mb(files['hibp_unsorted']), 'MB'
+
+
+@benchmark('multi_pro_search')
+def _multi_pro_search(files: Dict, params: Dict):
+    ad_users = password_audit.import_users(files['ad'])
+    worker_args = [ad_users, 'hibp', None, False, Hashing()]
+    matches = list(password_audit._multi_pro_search(
+        _quiet_logger(), files['hibp_unsorted'], params['block_size'], params['workers'], password_audit._worker,
+        worker_args, engine=params['engine'], ad_user_hashes=ad_users))
+    if not matches:
+        raise RuntimeError('multi_pro_search found no matches in the corpus')
+    return params['hibp_lines'], 'lines'
+
+
+@benchmark('hashing_engine')
+def _hashing_engine(files: Dict, params: Dict):
+    passwords = [f'Password{i}!' for i in range(params['passwords'])]
+    batches = [passwords[i:i + HASH_BATCH_SIZE] for i in range(0, len(passwords), HASH_BATCH_SIZE)]
+    with HashingEngine(params['workers']) as engine:
+        for _ in engine.digest_batches(batches):
+            pass
+    return len(passwords), 'hashes'
+
+
+@benchmark('enhance_password')
+def _enhance_password(files: Dict, params: Dict):
+    generator = CustomVariantGenerator(min_password_length=params['min_length'])
+    with open(files['custom']) as f:
+        custom_passwords = [line.strip() for line in f if line.strip()]
+    return sum(len(generator.enhance_password(password)) for password in custom_passwords), 'variants'
+
+
+@benchmark('sorted_search')
+def _sorted_search(files: Dict, params: Dict):
+    ad_users = password_audit.import_users(files['ad'])
+    password_audit.search(_quiet_logger(), files['hibp_sorted'], ad_users, 'hibp', False)
+    return len(ad_users), 'hashes'
+
+
+@benchmark('main')
+def _main(files: Dict, params: Dict):
+    sys.argv = ['lil-pwny', '-hibp', files['hibp_unsorted'], '-ad', files['ad'], '-c', files['custom'],
+                '-custom-enhance', str(params['min_length']), '-output', 'json', '-workers', str(params['workers'])]
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        lil_pwny.main()
+    finally:
+        sys.stdout = stdout
+    return params['hibp_lines'], 'lines'
+
+
+def _peak_rss_kb() -> int or None:
+    """ Peak resident set size of this process and its reaped child processes, in KB
+    """
+
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform != 'darwin' else 1 / 1024
+    return int(max(own, children) * scale)
+
+
+def run_single(name: str, files: Dict, params: Dict) -> Dict:
+    """ Run one benchmark in this process
+
+    Args:
+        name: name of the benchmark
+        files: paths of the corpus files
+        params: benchmark parameters
+    Returns:
+        Result of the benchmark
+    """
+
+    start = time.perf_counter()
+    count, unit = BENCHMARKS[name](files, params)
+    seconds = time.perf_counter() - start
+    return {
+        'name': name,
+        'params': params,
+        'seconds': round(seconds, 4),
+        'count': count,
+        'unit': unit,
+        'throughput': round(count / seconds, 2) if seconds else None,
+        'throughput_unit': f'{unit}/s',
+        'peak_rss_kb': _peak_rss_kb()
+    }
+
+
+def run_isolated(name: str, files: Dict, params: Dict) -> Dict:
+    """ Run one benchmark in a new Python process
+
+    Args:
+        name: name of the benchmark
+        files: paths of the corpus files
+        params: benchmark parameters
+    Returns:
+        Result of the benchmark
+    """
+
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--single', name, json.dumps({'files': files, 'params': params})],
+        check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def build_corpus(work_dir: str, args: argparse.Namespace) -> Dict:
+    """ Generate the corpus files, reusing files from a previous run with the same settings
+
+    Args:
+        work_dir: directory to write the corpus to
+        args: command line arguments
+    Returns:
+        Paths of the corpus files, and the number of each type of finding in the AD file
+    """
+
+    key = f'{args.seed}-{args.hibp_lines}-{args.ad_users}-{args.hit_rate}-{args.custom_passwords}'
+    files = {
+        'hibp_sorted': os.path.join(work_dir, f'hibp-sorted-{key}.txt'),
+        'hibp_unsorted': os.path.join(work_dir, f'hibp-unsorted-{key}.txt'),
+        'custom': os.path.join(work_dir, f'custom-{key}.txt'),
+        'ad': os.path.join(work_dir, f'ad-{key}.txt'),
+    }
+    if not os.path.exists(files['hibp_sorted']):
+        corpus.write_hibp(files['hibp_sorted'], args.hibp_lines, ordered=True, seed=args.seed, line_ending='\r\n')
+    if not os.path.exists(files['hibp_unsorted']):
+        corpus.write_hibp(files['hibp_unsorted'], args.hibp_lines, ordered=False, seed=args.seed)
+    custom_passwords = corpus.write_custom(files['custom'], args.custom_passwords, seed=args.seed)
+    expected_findings = corpus.write_ad(files['ad'], args.ad_users, args.hibp_lines, hibp_hit_rate=args.hit_rate,
+                                        custom_passwords=custom_passwords, seed=args.seed)
+    return {'files': files, 'expected_findings': expected_findings}
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Lil Pwny benchmarks against synthetic corpora')
+    parser.add_argument('--hibp-lines', type=int, default=1000000, help='Number of hashes in the HIBP files')
+    parser.add_argument('--ad-users', type=int, default=10000, help='Number of users in the AD file')
+    parser.add_argument('--hit-rate', type=float, default=0.1, help='Fraction of AD users whose hash is in HIBP')
+    parser.add_argument('--custom-passwords', type=int, default=3, help='Number of custom passwords')
+    parser.add_argument('--passwords', type=int, default=200000, help='Number of passwords to hash')
+    parser.add_argument('--min-length', type=int, default=8, help='Minimum length for --custom-enhance')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='Size in MB of the blocks the HIBP file is split into')
+    parser.add_argument('--workers', type=_int_list, default=[1, os.cpu_count() or 1],
+                        help='Comma separated worker counts to measure core scaling with')
+    parser.add_argument('--engines', default='python,numpy', help='Comma separated scan engines to measure')
+    parser.add_argument('--only', help='Comma separated benchmarks to run. Default is all of them')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic corpora')
+    parser.add_argument('--work-dir', help='Directory for the corpora. Default is a new temporary directory')
+    parser.add_argument('--out', default='benchmark-results.json', help='File to write the results to')
+    parser.add_argument('--single', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        name, config = args.single
+        config = json.loads(config)
+        print(json.dumps(run_single(name, config['files'], config['params'])))
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='lil-pwny-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    corpus_info = build_corpus(work_dir, args)
+    files = corpus_info['files']
+    base_params = {'hibp_lines': args.hibp_lines, 'block_size': args.block_size, 'passwords': args.passwords,
+                   'min_length': args.min_length}
+
+    engines = [engine for engine in args.engines.split(',') if engine != 'numpy' or numpy_matcher.is_available()]
+    runs = [('import_users', {}), ('divide_blocks', {}), ('sorted_search', {}), ('enhance_password', {})]
+    for workers in args.workers:
+        runs += [('multi_pro_search', {'workers': workers, 'engine': engine}) for engine in engines]
+        runs += [('hashing_engine', {'workers': workers}), ('main', {'workers': workers})]
+    if args.only:
+        runs = [run for run in runs if run[0] in args.only.split(',')]
+
+    results = []
+    for name, params in runs:
+        result = run_isolated(name, files, {**base_params, **params})
+        results.append(result)
+        print(f'{name:<18} {json.dumps(params):<40} {result["seconds"]:>9.3f}s'
+              f' {result["throughput"]:>14,.0f} {result["throughput_unit"]:<12} peak RSS {result["peak_rss_kb"]} KB',
+              file=sys.stderr)
+
+    report = {
+        'environment': {
+            'lil_pwny_version': metadata.version('lil-pwny'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': numpy_matcher.is_available(),
+        },
+        'corpus': {
+            'seed': args.seed,
+            'hibp_lines': args.hibp_lines,
+            'hibp_size_mb': round(corpus.file_size_mb(files['hibp_unsorted']), 2),
+            'ad_users': args.ad_users,
+            'custom_passwords': args.custom_passwords,
+            'expected_findings': corpus_info['expected_findings'],
+            'work_dir': work_dir,
+        },
+        'results': results
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.out}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
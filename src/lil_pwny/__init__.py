@@ -1,24 +1,36 @@
 import argparse
+import atexit
+import codecs
 import os
 import sys
-import tempfile
 import time
 import traceback
 from datetime import timedelta
 from importlib import metadata
-from typing import List, Dict
+from typing import List
 
-from lil_pwny import password_audit, hashing
+from lil_pwny import password_audit, hibp_index, numpy_matcher, result_sinks, server
+from lil_pwny.audit import AuditPlanner
+from lil_pwny.file_encoding import detect_encoding
 from lil_pwny.variant_generators.custom_variant_generator import CustomVariantGenerator
-from lil_pwny.variant_generators.username_variant_generator import UsernameVariantGenerator
-from lil_pwny.exceptions import FileReadError
+from lil_pwny.exceptions import AuditSourceError, FileReadError, IndexFormatError, MalformedHIBPError
 from lil_pwny.loggers import JSONLogger, StdoutLogger
+from lil_pwny.metrics import AuditMetrics
+from lil_pwny.result_cache import ResultCache
+from lil_pwny.variant_cache import VariantHashCache
 
 output_logger = JSONLogger
+# Message logged when each check of the audit fails
+SEARCH_ERRORS = {
+    'username': 'Error during username search',
+    'hibp': 'Error during HIBP search',
+    'custom': 'Error during custom password search'
+}
 
 
 def init_logger(logging_type: str, verbose: bool) -> JSONLogger or StdoutLogger:
-    """ Create a logger object. Defaults to stdout if no option is given
+    """ Create a logger object. Defaults to stdout if no option is given. Output is written to stdout by a single
+    OutputWriter thread, so logging from the search stages doesn't wait on stdout
 
     Args:
         logging_type: Type of logging to use
@@ -28,8 +40,8 @@ def init_logger(logging_type: str, verbose: bool) -> JSONLogger or StdoutLogger:
     """
 
     if not logging_type or logging_type == 'stdout':
-        return StdoutLogger(debug=verbose)
-    return JSONLogger(debug=verbose)
+        return StdoutLogger(debug=verbose, asynchronous=True)
+    return JSONLogger(debug=verbose, asynchronous=True)
 
 
 def get_readable_file_size(file_path: str) -> str:
@@ -48,55 +60,200 @@ def get_readable_file_size(file_path: str) -> str:
         file_size_bytes /= 1024
 
 
-def write_hash_temp_file(hash_list: List[str]) -> str:
-    """ Writes a list of hashes to a temporary file and returns the file path.
+def _encoding_name(value: str) -> str:
+    """ Validate an encoding name passed on the command line
 
-        Args:
-            hash_list: A list of hash strings to be written to the temporary file.
-        Returns:
-            str: The file path of the temporary file containing the hashes.
+    Args:
+        value: Name of the encoding
+    Returns:
+        The encoding name
     """
 
-    with tempfile.NamedTemporaryFile('w', delete=False) as temp_file:
-        temp_file.write('\n'.join(hash_list))
-    return temp_file.name
-
-
-def find_matches(log_handler: JSONLogger or StdoutLogger,
-                 filepath: str,
-                 ad_user_hashes: Dict[str, List[str]],
-                 finding_type: str,
-                 obfuscated: bool,
-                 logging_type: str) -> int:
-    """ Searches for matches between Active Directory user hashes and a provided hash file, logs the results,
-        and returns the number of matches found.
-
-        Args:
-            log_handler: The logger instance used to log messages.
-            filepath: The path to the file containing the hash data to compare against.
-            ad_user_hashes: A dictionary of NTLM hashes from Active Directory users.
-            finding_type: The type of match being searched for (e.g., 'hibp', 'custom', 'username').
-            obfuscated: Whether to obfuscate the matches found by hashing with a random salt.
-            logging_type: The type of logging output to use ('stdout', 'json', etc.).
-        Returns:
-            The number of matches found.
+    try:
+        codecs.lookup(value)
+    except LookupError:
+        raise argparse.ArgumentTypeError(f'unknown encoding: {value}')
+    return value
+
+
+def index_main(argv: List[str]) -> None:
+    """ Entry point for the `lil-pwny index` subcommand, which manages binary HIBP indexes
+
+    Args:
+        argv: command line arguments following `index`
     """
 
-    matches = password_audit.search(
-        log_handler=log_handler,
-        hibp_hashes_filepath=filepath,
-        ad_user_hashes=ad_user_hashes,
-        finding_type=finding_type,
-        obfuscated=obfuscated)
-    number_of_matches = len(matches)
-    if logging_type != 'stdout':
-        for match in matches:
-            log_handler.log('NOTIFY', match, notify_type=finding_type)
+    parser = argparse.ArgumentParser(
+        prog='lil-pwny index',
+        description='Build and verify compact binary indexes of the HIBP NTLM hash file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser(
+        'build',
+        help='Convert a text HIBP file into a binary index that can be passed to -hibp/--hibp')
+    build_parser.add_argument(
+        '-hibp', '--hibp',
+        help='The .txt file containing HIBP NTLM hashes, which may be compressed with gzip, xz or bz2',
+        dest='hibp',
+        required=True)
+    build_parser.add_argument(
+        '-out', '--out',
+        help='Path to write the binary index to',
+        dest='out',
+        required=True)
+    build_parser.add_argument(
+        '-encoding', '--encoding',
+        type=_encoding_name,
+        dest='encoding',
+        help='Encoding of the HIBP file. Detected automatically if not given')
+    verify_parser = subparsers.add_parser(
+        'verify',
+        help='Check a binary index against its checksum')
+    verify_parser.add_argument(
+        'index',
+        help='Path to the binary index')
+    for subparser in [build_parser, verify_parser]:
+        subparser.add_argument(
+            '-output', '--output',
+            choices=['stdout', 'json'],
+            dest='logging_type',
+            default='stdout',
+            help='Where to send results')
+        subparser.add_argument(
+            '--verbose',
+            dest='verbose',
+            action='store_true',
+            help='Turn on verbose logging')
 
-    return number_of_matches
+    args = parser.parse_args(argv)
+    logger = init_logger(args.logging_type, args.verbose)
+    start = time.time()
+
+    try:
+        if args.command == 'build':
+            logger.log('INFO', f'Building HIBP index from {args.hibp} ({get_readable_file_size(args.hibp)})...')
+            record_count = hibp_index.build_index(args.hibp, args.out, encoding=args.encoding)
+            logger.log('SUCCESS', f'Wrote {record_count} hashes to {args.out}'
+                                  f' ({get_readable_file_size(args.out)})')
+        else:
+            logger.log('INFO', f'Verifying HIBP index {args.index}...')
+            with hibp_index.HIBPIndex(args.index) as index:
+                if not index.verify():
+                    logger.log('CRITICAL', f'Checksum mismatch, the index is corrupt: {args.index}')
+                    sys.exit(1)
+                logger.log('SUCCESS', f'Index is valid and contains {len(index)} hashes')
+    except FileNotFoundError as e:
+        logger.log('CRITICAL', f'File not found: {e.filename}')
+        sys.exit(1)
+    except (IndexFormatError, MalformedHIBPError) as e:
+        logger.log('CRITICAL', str(e))
+        sys.exit(1)
+
+    logger.log('SUCCESS', f'Time taken: {str(timedelta(seconds=time.time() - start))}')
+
+
+def serve_main(argv: List[str]) -> None:
+    """ Entry point for the `lil-pwny serve` subcommand, which keeps the HIBP file open and runs audit jobs sent by
+    `lil-pwny client` over a Unix socket
+
+    Args:
+        argv: command line arguments following `serve`
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='lil-pwny serve',
+        description='Keep a HIBP index open and audit AD users sent with `lil-pwny client` over a Unix socket')
+    parser.add_argument(
+        '-hibp', '--hibp',
+        help='Binary HIBP index created with `lil-pwny index build`, or a HIBP .txt file ordered by hash',
+        dest='hibp',
+        required=True)
+    parser.add_argument(
+        '-socket', '--socket',
+        help='Path of the Unix socket to listen on',
+        dest='socket',
+        required=True)
+    parser.add_argument(
+        '-output', '--output',
+        choices=['stdout', 'json'],
+        dest='logging_type',
+        default='stdout',
+        help='Where to send server logs')
+    parser.add_argument(
+        '--verbose',
+        dest='verbose',
+        action='store_true',
+        help='Turn on verbose logging')
+
+    args = parser.parse_args(argv)
+    logger = init_logger(args.logging_type, args.verbose)
+    try:
+        server.serve(args.hibp, args.socket, logger)
+    except FileNotFoundError as e:
+        logger.log('CRITICAL', f'HIBP file not found: {e.filename}')
+        sys.exit(1)
+    except Exception as e:
+        logger.log('CRITICAL', str(e))
+        sys.exit(1)
+
+
+def client_main(argv: List[str]) -> None:
+    """ Entry point for the `lil-pwny client` subcommand, which sends AD users to a running `lil-pwny serve` and
+    writes the JSON findings to stdout
+
+    Args:
+        argv: command line arguments following `client`
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='lil-pwny client',
+        description='Audit AD users against a running `lil-pwny serve`. Findings are written to stdout as JSON')
+    parser.add_argument(
+        '-socket', '--socket',
+        help='Path of the Unix socket the server is listening on',
+        dest='socket',
+        required=True)
+    parser.add_argument(
+        '-ad', '--ad-hashes',
+        help='The .txt file containing NTLM hashes from AD users, or - to read them from stdin',
+        dest='ad_hashes',
+        required=True)
+    parser.add_argument(
+        '-o', '--obfuscate',
+        action='store_true',
+        dest='obfuscate',
+        default=False,
+        help='Obfuscate hashes from discovered matches by hashing with a random salt')
+    parser.add_argument(
+        '-encoding', '--encoding',
+        type=_encoding_name,
+        dest='encoding',
+        help='Encoding of the AD user file. Detected automatically if not given')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.ad_hashes == '-':
+            succeeded = server.submit_job(args.socket, sys.stdin, args.obfuscate, sys.stdout)
+        else:
+            encoding = args.encoding or detect_encoding(args.ad_hashes)
+            with open(args.ad_hashes, encoding=encoding) as ad_file:
+                succeeded = server.submit_job(args.socket, ad_file, args.obfuscate, sys.stdout)
+    except (OSError, FileReadError) as e:
+        sys.stderr.write(f'lil-pwny client: {str(e)}\n')
+        sys.exit(1)
+    if not succeeded:
+        sys.exit(1)
 
 
 def main():
+    subcommands = {
+        'index': index_main,
+        'serve': serve_main,
+        'client': client_main
+    }
+    if sys.argv[1:2] and sys.argv[1] in subcommands:
+        subcommands[sys.argv[1]](sys.argv[2:])
+        return
+
     try:
         start = time.time()
         project_metadata = metadata.metadata('lil-pwny')
@@ -104,7 +261,8 @@ def main():
         parser = argparse.ArgumentParser(description='Fast offline auditing of Active Directory passwords using Python')
         parser.add_argument(
             '-hibp', '--hibp',
-            help='The .txt file containing HIBP NTLM hashes',
+            help='The .txt file containing HIBP NTLM hashes, which may be compressed with gzip, xz or bz2, or a binary'
+                 ' index created with `lil-pwny index build`',
             dest='hibp',
             required=True)
         parser.add_argument(
@@ -123,8 +281,10 @@ def main():
             dest='custom_enhance')
         parser.add_argument(
             '-ad', '--ad-hashes',
-            help='The .txt file containing NTLM hashes from AD users',
+            help='The .txt file containing NTLM hashes from AD users. Several files, or directories of them, can be'
+                 ' given to audit them in a single pass over the HIBP file, with each finding tagged with its file',
             dest='ad_hashes',
+            nargs='+',
             required=True)
         parser.add_argument(
             '-d', '--duplicates',
@@ -143,6 +303,52 @@ def main():
             dest='obfuscate',
             default=False,
             help='Obfuscate hashes from discovered matches by hashing with a random salt')
+        parser.add_argument(
+            '-workers', '--workers',
+            type=int,
+            dest='workers',
+            default=password_audit.DEFAULT_WORKERS,
+            help='Number of worker processes used to scan hash files. Default is one less than the number of CPUs')
+        parser.add_argument(
+            '-block-size', '--block-size',
+            type=int,
+            dest='block_size',
+            default=password_audit.DEFAULT_BLOCK_SIZE,
+            help='Size in MB of the blocks hash files are split into for scanning. Default is 100')
+        parser.add_argument(
+            '-engine', '--engine',
+            choices=password_audit.SCAN_ENGINES,
+            dest='engine',
+            default='auto',
+            help='Engine used to scan hash files. numpy requires NumPy to be installed. Default is auto, which uses'
+                 ' numpy when it is available')
+        parser.add_argument(
+            '-encoding', '--encoding',
+            type=_encoding_name,
+            dest='encoding',
+            help='Encoding of the AD user file. Detected automatically if not given')
+        parser.add_argument(
+            '-hibp-encoding', '--hibp-encoding',
+            type=_encoding_name,
+            dest='hibp_encoding',
+            help='Encoding of the HIBP file. Detected automatically if not given')
+        parser.add_argument(
+            '-cache-dir', '--cache-dir',
+            dest='cache_dir',
+            help='Directory to cache HIBP results and custom password variant hashes in. Hashes checked in a previous'
+                 ' run against the same HIBP file are not searched for again, and variants of unchanged custom'
+                 ' passwords are not generated again. AD hashes are stored as salted fingerprints')
+        parser.add_argument(
+            '-results-file', '--results-file',
+            dest='results_file',
+            help='File to stream findings to instead of the output, as NDJSON (.ndjson or .jsonl) or CSV (.csv),'
+                 ' compressed with gzip if the name ends in .gz')
+        parser.add_argument(
+            '-metrics', '--metrics',
+            dest='metrics',
+            action='store_true',
+            help='Output the wall and CPU time, throughput, worker busy time and peak memory of each stage of the'
+                 ' audit as a JSON record when it completes')
         parser.add_argument(
             '--verbose',
             dest='verbose',
@@ -152,23 +358,43 @@ def main():
         args = parser.parse_args()
         hibp_file = args.hibp
         custom_passwords = args.custom
-        ad_hash_file = args.ad_hashes
+        ad_hash_files = password_audit.ad_user_files(args.ad_hashes)
         duplicates = args.d
         logging_type = args.logging_type
         obfuscate = args.obfuscate
         verbose = args.verbose
         custom_enhance = args.custom_enhance
-
-        hasher = hashing.Hashing()
+        workers = args.workers
+        block_size = args.block_size
+        engine = args.engine
+        encoding = args.encoding
+        hibp_encoding = args.hibp_encoding
+        cache_dir = args.cache_dir
+        metrics = AuditMetrics()
+        if workers < 1 or block_size < 1:
+            parser.error('--workers and --block-size must be at least 1')
+        if engine == 'numpy' and not numpy_matcher.is_available():
+            parser.error('--engine numpy requires NumPy. Install it with `pip install lil-pwny[numpy]`')
 
         if logging_type == 'file':
             logging_type = 'stdout'
             logger = init_logger(logging_type, verbose)
             logger.log('WARNING', 'File output is no longer supported.'
-                                  ' Select JSON output and redirect this to file. Defaulting to stdout')
+                                  ' Use --results-file to write findings to a file. Defaulting to stdout')
         else:
             logger = init_logger(logging_type, verbose)
 
+        results_sink = None
+        if args.results_file:
+            try:
+                results_sink = result_sinks.open_sink(args.results_file)
+            except (OSError, ValueError) as e:
+                logger.log('CRITICAL', f'Error opening results file: {str(e)}')
+                sys.exit(1)
+            # Findings written so far are kept if the audit exits early
+            atexit.register(results_sink.close)
+            logger.sink = results_sink
+
         logger.log('SUCCESS', 'Lil Pwny started execution')
         logger.log('INFO', f'Version: {project_metadata.get("version")}')
         logger.log('INFO', f'Created by: {project_metadata.get("author")}')
@@ -176,8 +402,17 @@ def main():
 
         # Load AD user hashes
         try:
-            ad_users = password_audit.import_users(ad_hash_file)
-            ad_lines = sum(len(ls) for ls in ad_users.values())
+            with metrics.stage('ad_load') as stage:
+                if not ad_hash_files:
+                    raise ValueError(f'No AD user files found in {", ".join(args.ad_hashes)}')
+                if len(args.ad_hashes) == 1 and not os.path.isdir(args.ad_hashes[0]):
+                    ad_users = password_audit.import_users(ad_hash_files[0], encoding=encoding)
+                else:
+                    ad_users = password_audit.import_user_files(ad_hash_files, encoding=encoding)
+                    logger.log('INFO', f'Merged AD users from {len(ad_hash_files)} files')
+                ad_lines = sum(len(ls) for ls in ad_users.values())
+                stage.lines = ad_lines
+                stage.bytes = sum(os.path.getsize(filepath) for filepath in ad_hash_files)
         except FileNotFoundError as e:
             logger.log('CRITICAL', f'AD user file not found: {e.filename}')
             sys.exit(1)
@@ -185,22 +420,6 @@ def main():
             logger.log('CRITICAL', f'Error loading AD user hashes: {str(e)}')
             sys.exit(1)
 
-        # Check username variations
-        logger.log('SUCCESS', f'Finding users using passwords that are a variation of their username...')
-        username_variants = UsernameVariantGenerator().generate_variations(ad_users)
-        logger.log('DEBUG', f'{len(username_variants)} username variants generated ')
-        username_hashes = hasher.get_hashes(username_variants)
-        logger.log('DEBUG', f'Converting username variants to NTLM hashes ')
-        username_temp_filepath = write_hash_temp_file(username_hashes)
-
-        username_count = find_matches(
-            log_handler=logger,
-            filepath=username_temp_filepath,
-            ad_user_hashes=ad_users,
-            finding_type='username',
-            obfuscated=obfuscate,
-            logging_type=logging_type)
-
         # Check HIBP file size
         try:
             logger.log('SUCCESS', f'Size of HIBP file provided {get_readable_file_size(hibp_file)}')
@@ -208,77 +427,50 @@ def main():
             logger.log('CRITICAL', f'HIBP file not found: {e.filename}')
             sys.exit(1)
 
-        # Compare AD users against HIBP hashes
+        # Plan the username, HIBP and custom password checks, which run together with one worker pool
+        planner = AuditPlanner(
+            log_handler=logger,
+            ad_user_hashes=ad_users,
+            obfuscated=obfuscate,
+            workers=workers,
+            metrics=metrics)
+        logger.log('SUCCESS', f'Finding users using passwords that are a variation of their username...')
+        planner.add_usernames()
+
         logger.log('SUCCESS', f'Comparing {ad_lines} AD users against HIBP compromised passwords...')
         try:
-            hibp_count = find_matches(
-                log_handler=logger,
-                filepath=hibp_file,
-                ad_user_hashes=ad_users,
-                finding_type='hibp',
-                obfuscated=obfuscate,
-                logging_type=logging_type)
-        except FileNotFoundError as e:
-            logger.log('CRITICAL', f'HIBP file not found: {e.filename}')
-            sys.exit(1)
+            hibp_cache = None
+            if cache_dir:
+                hibp_cache = ResultCache(cache_dir, hibp_file)
+                logger.log('INFO', f'Loaded {len(hibp_cache)} cached HIBP results from {hibp_cache.filepath}')
         except Exception as e:
             logger.log('CRITICAL', f'Error during HIBP search: {str(e)}')
             sys.exit(1)
+        planner.add_hibp(hibp_file, block_size=block_size, engine=engine, encoding=hibp_encoding, cache=hibp_cache)
 
-        # Handle custom passwords if provided
-        custom_count = 0
         if custom_passwords:
             try:
                 logger.log('INFO', 'Loading custom password list...')
-                with open(custom_passwords, 'r') as f:
+                with metrics.stage('custom_passwords') as stage, open(custom_passwords, 'r') as f:
                     custom_passwords = [line.strip() for line in f if line.strip()]
+                    stage.lines = len(custom_passwords)
+                    stage.bytes = f.tell()
                     logger.log('SUCCESS', f'Loaded {len(custom_passwords)} custom passwords')
 
                 if custom_enhance:
-                    custom_count = 0
-                    variants_count = 0
                     logger.log('INFO', 'Enhancing custom password list by adding variations...')
                     custom_client = CustomVariantGenerator(min_password_length=int(custom_enhance))
-                    for custom_pwd in custom_passwords:
-                        logger.log('DEBUG', f'Generating variants for `{custom_pwd}`...')
-                        temp_custom_passwords = custom_client.enhance_password(custom_pwd)
-
-                        logger.log('DEBUG', 'Converting custom passwords to NTLM hashes...')
-                        custom_password_hashes = hasher.get_hashes(temp_custom_passwords)
-                        variants_count += len(custom_password_hashes)
-                        logger.log('SUCCESS', f'Generated {len(custom_password_hashes)} variants for `{custom_pwd}`')
-
-                        custom_temp_file_path = write_hash_temp_file(custom_password_hashes)
-                        logger.log('DEBUG', f'Custom hashes written to temp file {custom_temp_file_path}')
-                        logger.log('INFO', f'Comparing {ad_lines} Active Directory'
-                                           f' users against {len(custom_password_hashes)} custom password hashes...')
-
-                        custom_count += find_matches(
-                            log_handler=logger,
-                            filepath=custom_temp_file_path,
-                            ad_user_hashes=ad_users,
-                            finding_type='custom',
-                            obfuscated=obfuscate,
-                            logging_type=logging_type)
-                        os.remove(custom_temp_file_path)
-                        logger.log('DEBUG', f'Temp file {custom_temp_file_path} deleted')
+                    variant_cache = None
+                    if cache_dir:
+                        variant_cache = VariantHashCache(cache_dir, int(custom_enhance),
+                                                         project_metadata.get('version'))
+                    logger.log('INFO', f'Comparing {ad_lines} Active Directory'
+                                       f' users against variants of {len(custom_passwords)} custom passwords...')
+                    planner.add_custom(custom_passwords, variant_generator=custom_client, variant_cache=variant_cache)
                 else:
-                    logger.log('DEBUG', 'Converting custom passwords to NTLM hashes...')
-                    custom_password_hashes = hasher.get_hashes(custom_passwords)
-                    custom_temp_file_path = write_hash_temp_file(custom_password_hashes)
-                    logger.log('DEBUG', f'Custom hashes written to temp file {custom_temp_file_path}')
-
                     logger.log('INFO', f'Comparing {ad_lines} Active Directory'
-                                       f' users against {len(custom_password_hashes)} custom password hashes...')
-                    custom_count += find_matches(
-                        log_handler=logger,
-                        filepath=custom_temp_file_path,
-                        ad_user_hashes=ad_users,
-                        finding_type='custom',
-                        obfuscated=obfuscate,
-                        logging_type=logging_type)
-                    os.remove(custom_temp_file_path)
-                    logger.log('DEBUG', f'Temp file {custom_temp_file_path} deleted')
+                                       f' users against {len(custom_passwords)} custom passwords...')
+                    planner.add_custom(custom_passwords)
             except FileNotFoundError as e:
                 logger.log('CRITICAL', f'Custom password file not found: {e.filename}')
                 sys.exit(1)
@@ -286,15 +478,38 @@ def main():
                 logger.log('CRITICAL', f'Error during custom password search: {str(e)}')
                 sys.exit(1)
 
+        # Run the checks, outputting the findings of each as soon as it completes
+        match_counts = {'username': 0, 'hibp': 0, 'custom': 0}
+        try:
+            for finding_type, matches in planner.run():
+                match_counts[finding_type] = len(matches)
+                with metrics.stage('output'):
+                    if logging_type != 'stdout':
+                        for match in matches:
+                            logger.log('NOTIFY', match, notify_type=finding_type)
+        except AuditSourceError as e:
+            if e.finding_type == 'hibp' and isinstance(e.error, FileNotFoundError):
+                logger.log('CRITICAL', f'HIBP file not found: {e.error.filename}')
+            else:
+                logger.log('CRITICAL', f'{SEARCH_ERRORS[e.finding_type]}: {str(e.error)}')
+            sys.exit(1)
+        username_count = match_counts['username']
+        hibp_count = match_counts['hibp']
+        custom_count = match_counts['custom']
+        variants_count = planner.variants_count
+
         # Handle duplicates if requested
         duplicate_count = 0
         if duplicates:
             try:
                 logger.log('INFO', 'Finding users with duplicate passwords...')
-                duplicate_results = password_audit.find_duplicates(ad_users, obfuscate)
+                with metrics.stage('duplicates') as stage:
+                    duplicate_results = password_audit.find_duplicates(ad_users, obfuscate)
+                    stage.lines = ad_lines
                 duplicate_count = len(duplicate_results)
-                for duplicate_match in duplicate_results:
-                    logger.log('NOTIFY', duplicate_match, notify_type='duplicate')
+                with metrics.stage('output'):
+                    for duplicate_match in duplicate_results:
+                        logger.log('NOTIFY', duplicate_match, notify_type='duplicate')
             except Exception as e:
                 logger.log('CRITICAL', f'Error finding duplicates: {str(e)}')
                 sys.exit(1)
@@ -311,7 +526,12 @@ def main():
             logger.log('SUCCESS', f'Variant passwords generated from {len(custom_passwords)} custom passwords:'
                                   f' {variants_count}')
         logger.log('SUCCESS', f'Passwords duplicated (being used by multiple user accounts): {duplicate_count}')
+        if results_sink is not None:
+            results_sink.close()
+            logger.log('SUCCESS', f'Wrote {results_sink.count} findings to {results_sink.filepath}')
         logger.log('SUCCESS', f'Time taken: {str(timedelta(seconds=time_taken))}')
+        if args.metrics:
+            logger.log('METRICS', metrics.to_dict())
 
     except Exception as e:
         logger.log('CRITICAL', str(e))
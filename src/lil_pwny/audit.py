@@ -0,0 +1,169 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from lil_pwny import password_audit
+from lil_pwny.exceptions import AuditSourceError
+from lil_pwny.hashing import HashingEngine
+from lil_pwny.loggers import JSONLogger, StdoutLogger
+from lil_pwny.metrics import AuditMetrics
+from lil_pwny.result_cache import ResultCache
+from lil_pwny.variant_cache import VariantHashCache
+from lil_pwny.variant_generators.custom_variant_generator import CustomVariantGenerator
+from lil_pwny.worker_pool import WorkerPool
+
+
+class AuditPlanner(object):
+    """ Runs every check of an audit against the AD user hashes with one shared pool of worker processes, so
+    processes are only started once.
+
+    Checks are added with the add_ methods, then run together with `run`. Scans of hash files, such as the HIBP file,
+    run in a background thread, while candidate passwords, such as username variants and custom passwords, are hashed
+    in another. Both send their jobs to the same pool, so hashing candidates does not wait for the scan to finish.
+    The findings of each check are yielded as soon as it completes.
+    """
+
+    def __init__(self,
+                 log_handler: JSONLogger or StdoutLogger,
+                 ad_user_hashes: Dict[str, List[str]],
+                 obfuscated: bool,
+                 workers: int = password_audit.DEFAULT_WORKERS,
+                 metrics: AuditMetrics = None):
+        self.log_handler = log_handler
+        self.ad_user_hashes = ad_user_hashes
+        self.obfuscated = obfuscated
+        self.workers = max(workers, 1)
+        self.metrics = metrics or AuditMetrics()
+        self.variants_count = 0
+        self._scans: List[Tuple[str, Callable]] = []
+        self._candidates: List[Tuple[str, Callable]] = []
+        self._pool = None
+        self._hash_engine = None
+
+    def add_usernames(self) -> None:
+        """ Check for users whose password is a variation of their username
+        """
+
+        def _search() -> List[dict]:
+            with self.metrics.stage('username_variants') as stage:
+                hash_count, hash_time = self._hash_engine.hash_count, self._hash_engine.hash_time
+                matches = password_audit.search_usernames(
+                    log_handler=self.log_handler,
+                    ad_user_hashes=self.ad_user_hashes,
+                    finding_type='username',
+                    obfuscated=self.obfuscated,
+                    hash_engine=self._hash_engine)
+                stage.lines = sum(len(usernames) for usernames in self.ad_user_hashes.values())
+                stage.add_hashing(self._hash_engine.hash_count - hash_count,
+                                  self._hash_engine.hash_time - hash_time)
+            return matches
+
+        self._candidates.append(('username', _search))
+
+    def add_hibp(self,
+                 filepath: str,
+                 block_size: int = password_audit.DEFAULT_BLOCK_SIZE,
+                 engine: str = 'auto',
+                 encoding: str = None,
+                 cache: ResultCache = None) -> None:
+        """ Check for users whose hash is in the HIBP file
+
+        Args:
+            filepath: path to the HIBP file or binary index
+            block_size: size in MB of the blocks the file is split into for scanning
+            engine: engine used to scan blocks, one of password_audit.SCAN_ENGINES
+            encoding: encoding of the file. Detected from the start of the file if not given
+            cache: result cache for the file
+        """
+
+        def _search() -> List[dict]:
+            with self.metrics.stage('hibp_scan') as stage:
+                return password_audit.search(
+                    log_handler=self.log_handler,
+                    hibp_hashes_filepath=filepath,
+                    ad_user_hashes=self.ad_user_hashes,
+                    finding_type='hibp',
+                    obfuscated=self.obfuscated,
+                    workers=self.workers,
+                    block_size=block_size,
+                    engine=engine,
+                    encoding=encoding,
+                    cache=cache,
+                    metrics=stage,
+                    pool=self._pool)
+
+        self._scans.append(('hibp', _search))
+
+    def add_custom(self,
+                   passwords: List[str],
+                   variant_generator: CustomVariantGenerator = None,
+                   variant_cache: VariantHashCache = None) -> None:
+        """ Check for users whose password is one of the custom passwords, or one of their variants if a variant
+        generator is given. The number of variants checked is kept in `variants_count`
+
+        Args:
+            passwords: plaintext custom passwords
+            variant_generator: generator for the variants of each custom password
+            variant_cache: cache of the digests of the variants of each custom password
+        """
+
+        def _search() -> List[dict]:
+            with self.metrics.stage('custom_passwords') as stage:
+                hash_count, hash_time = self._hash_engine.hash_count, self._hash_engine.hash_time
+                if variant_generator is None:
+                    matches = password_audit.search_passwords(
+                        log_handler=self.log_handler,
+                        passwords=passwords,
+                        ad_user_hashes=self.ad_user_hashes,
+                        finding_type='custom',
+                        obfuscated=self.obfuscated,
+                        hash_engine=self._hash_engine)
+                else:
+                    matches, self.variants_count = password_audit.search_custom_variants(
+                        log_handler=self.log_handler,
+                        custom_passwords=passwords,
+                        variant_generator=variant_generator,
+                        ad_user_hashes=self.ad_user_hashes,
+                        finding_type='custom',
+                        obfuscated=self.obfuscated,
+                        hash_engine=self._hash_engine,
+                        variant_cache=variant_cache)
+                    stage.counters['variants'] = self.variants_count
+                stage.add_hashing(self._hash_engine.hash_count - hash_count,
+                                  self._hash_engine.hash_time - hash_time)
+            return matches
+
+        self._candidates.append(('custom', _search))
+
+    def run(self) -> Iterator[Tuple[str, List[dict]]]:
+        """ Run every check that has been added, starting the worker pool once for all of them
+
+        Returns:
+            Generator of the finding type and findings of each check, in the order the checks complete
+        Raises:
+            AuditSourceError: if a check fails. The pool is terminated without waiting for the other checks
+        """
+
+        results = queue.Queue()
+
+        def _run_checks(checks: List[Tuple[str, Callable]]) -> None:
+            for finding_type, search_function in checks:
+                try:
+                    results.put((finding_type, search_function()))
+                except Exception as e:
+                    results.put((finding_type, AuditSourceError(finding_type, e)))
+                    return
+
+        with WorkerPool(self.workers) as self._pool:
+            self._hash_engine = HashingEngine(self.workers, pool=self._pool.pool)
+            threads = [threading.Thread(target=_run_checks, args=(checks,), daemon=True)
+                       for checks in [self._scans, self._candidates] if checks]
+            for thread in threads:
+                thread.start()
+            for _ in range(len(self._scans) + len(self._candidates)):
+                finding_type, findings = results.get()
+                if isinstance(findings, AuditSourceError):
+                    raise findings
+                yield finding_type, findings
+            for thread in threads:
+                thread.join()
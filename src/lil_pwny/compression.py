@@ -0,0 +1,96 @@
+import bz2
+import gzip
+import lzma
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+# Magic numbers at the start of each supported compressed format
+MAGIC_NUMBERS = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'bz2': b'BZh',
+}
+OPENERS = {
+    'gzip': gzip.open,
+    'xz': lzma.open,
+    'bz2': bz2.open,
+}
+
+
+def compression_format(filepath: str) -> Optional[str]:
+    """ Detect whether a file is compressed from the magic number at its start
+
+    Args:
+        filepath: Path to the file
+    Returns:
+        'gzip', 'xz' or 'bz2', or None if the file is not compressed in a supported format
+    """
+
+    with open(filepath, 'rb') as f:
+        header = f.read(max(len(magic) for magic in MAGIC_NUMBERS.values()))
+    for name, magic in MAGIC_NUMBERS.items():
+        if header.startswith(magic):
+            return name
+    return None
+
+
+def open_binary(filepath: str) -> BinaryIO:
+    """ Open a file for reading bytes, decompressing it if it is compressed
+
+    Args:
+        filepath: Path to the file
+    Returns:
+        Binary file object of the decompressed content
+    """
+
+    name = compression_format(filepath)
+    if name is None:
+        return open(filepath, 'rb')
+    return OPENERS[name](filepath, 'rb')
+
+
+class ChunkReader:
+    """ Streams a compressed file as line aligned chunks of decompressed bytes, so it can be scanned in parallel
+    without decompressing it to disk first.
+
+    Each chunk is yielded with its offset in the decompressed content. The number of compressed bytes read to
+    produce each chunk is kept in `compressed_bytes`, keyed by offset, so progress can be measured against the size
+    of the compressed file. Decompression runs in the process iterating the reader, and a file is decompressed from
+    start to end even if it has several gzip members or xz blocks, as the standard library cannot locate them
+    without decompressing the data before them.
+    """
+
+    def __init__(self, filepath: str, chunk_size: int, skip_lines: int = 0):
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.skip_lines = skip_lines
+        self.format = compression_format(filepath)
+        self.compressed_bytes: Dict[int, int] = {}
+        self.decompressed_bytes = 0
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        with open(self.filepath, 'rb') as raw, OPENERS[self.format](raw, 'rb') as f:
+            for _ in range(self.skip_lines):
+                f.readline()
+            offset = f.tell()
+            compressed_position = 0
+            remainder = b''
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                chunk = remainder + data
+                # Carry any partial line at the end of the chunk over to the next one
+                line_end = chunk.rfind(b'\n') + 1
+                if not line_end:
+                    remainder = chunk
+                    continue
+                chunk, remainder = chunk[:line_end], chunk[line_end:]
+                self.compressed_bytes[offset] = raw.tell() - compressed_position
+                compressed_position = raw.tell()
+                yield offset, chunk
+                offset += len(chunk)
+                self.decompressed_bytes += len(chunk)
+            if remainder:
+                self.compressed_bytes[offset] = raw.tell() - compressed_position
+                yield offset, remainder
+                self.decompressed_bytes += len(remainder)
@@ -30,3 +30,41 @@ class FileReadError(HashingError):
         self.filename = filename
         self.message = message
         super().__init__(f"{self.message}: {self.filename}")
+
+
+class IndexFormatError(Exception):
+    """ Exception raised when a binary HIBP index is invalid or corrupt
+
+    Attributes:
+        filename: The name of the index file which caused the error.
+        message: Explanation of the error.
+    """
+
+    def __init__(self, filename, message='Invalid HIBP index'):
+        """
+        Args:
+            filename: The name of the index file which caused the error.
+            message: Explanation of the error. Defaults to "Invalid HIBP index".
+        """
+        self.filename = filename
+        self.message = message
+        super().__init__(f"{self.message}: {self.filename}")
+
+
+class AuditSourceError(Exception):
+    """ Exception raised when one of the checks of an audit fails
+
+    Attributes:
+        finding_type: The type of finding of the check which failed, e.g. 'hibp' or 'custom'.
+        error: The exception raised by the check.
+    """
+
+    def __init__(self, finding_type, error):
+        """
+        Args:
+            finding_type: The type of finding of the check which failed.
+            error: The exception raised by the check.
+        """
+        self.finding_type = finding_type
+        self.error = error
+        super().__init__(f"Error during {finding_type} search: {error}")
@@ -0,0 +1,65 @@
+import codecs
+
+from charset_normalizer import from_bytes
+
+from lil_pwny.compression import open_binary
+from lil_pwny.exceptions import FileReadError
+
+# Byte order marks, longest first so UTF-32 is not mistaken for UTF-16
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF32_LE, 'utf_32'),
+    (codecs.BOM_UTF32_BE, 'utf_32'),
+    (codecs.BOM_UTF8, 'utf_8_sig'),
+    (codecs.BOM_UTF16_LE, 'utf_16'),
+    (codecs.BOM_UTF16_BE, 'utf_16'),
+]
+SAMPLE_SIZE = 1024 * 64
+
+
+def detect_encoding(filepath: str, sample_size: int = SAMPLE_SIZE) -> str:
+    """ Detect the encoding of a file from a bounded sample at its start. Compressed files are sampled from the
+    start of their decompressed content.
+
+    Byte order marks are checked first, then whether the sample is valid ASCII or UTF-8, which covers hash files
+    exported by DSInternals and the HIBP downloader. Only if these fail is the slower charset_normalizer detection run.
+
+    Args:
+        filepath: Path to the file
+        sample_size: Number of bytes from the start of the file to inspect
+    Returns:
+        Name of the encoding
+    """
+
+    with open_binary(filepath) as f:
+        sample = f.read(sample_size)
+
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+
+    # An ASCII sample is read as UTF-8, a superset of ASCII, so non-ASCII characters later in the file still decode
+    if sample.isascii():
+        return 'utf_8'
+    try:
+        # The sample may end part way through a multi-byte character
+        codecs.getincrementaldecoder('utf_8')().decode(sample, final=False)
+        return 'utf_8'
+    except UnicodeDecodeError:
+        pass
+
+    best_match = from_bytes(sample).best()
+    if best_match is None:
+        raise FileReadError(filepath, 'Unable to detect the encoding of file, set it with --encoding')
+    return best_match.encoding
+
+
+def is_ascii_compatible(encoding: str) -> bool:
+    """ Check whether hashes can be read directly from the raw bytes of a file in the given encoding
+
+    Args:
+        encoding: Name of the encoding
+    Returns:
+        True if hex characters, colons and line breaks are encoded as single ASCII bytes
+    """
+
+    return codecs.lookup(encoding).name == 'utf-8-sig' or '0:\n'.encode(encoding) == b'0:\n'
@@ -1,48 +1,124 @@
 import binascii
+import collections
 import hashlib
 import secrets
-from typing import List
+import time
+from typing import Iterable, Iterator, List, Tuple
 from multiprocessing import Pool, cpu_count
 
 
 from Crypto.Hash import MD4
 
+from lil_pwny import numpy_ntlm
 
-class Hashing(object):
-    """ Class to handle hashing and obfuscation of strings
+# Number of passwords sent to a worker process in each job by HashingEngine
+HASH_BATCH_SIZE = 10000
+DIGEST_SIZE = 16
+# Smallest batch that is hashed with the NumPy kernel, below which its setup costs more than it saves
+NUMPY_MIN_BATCH_SIZE = 64
+
+
+def ntlm_digests(passwords: List[str]) -> bytes:
+    """ Converts a batch of passwords to raw NTLM digests. If NumPy is installed, batches are hashed with the
+    vectorised kernel in numpy_ntlm
+
+    Args:
+        passwords: passwords to hash
+    Returns:
+        The 16 byte digest of each password, concatenated in the same order as the passwords
     """
 
-    def __init__(self):
-        self.salt = secrets.token_hex(8)
+    if numpy_ntlm.is_available() and len(passwords) >= NUMPY_MIN_BATCH_SIZE:
+        return numpy_ntlm.ntlm_digests(passwords)
+    return b''.join(MD4.new(password.encode('utf-16le')).digest() for password in passwords)
 
-    @staticmethod
-    def _hashify(input_string: str) -> str:
-        """ Converts the input string to a NTLM hash and returns the hash
 
-        Args:
-            input_string: string to be converted to NTLM hash
-        Returns:
-            Converted NTLM hash
+def split_digests(digests: bytes) -> List[bytes]:
+    """ Splits concatenated digests from ntlm_digests into a list of 16 byte digests
+
+    Args:
+        digests: concatenated digests
+    Returns:
+        List of digests
+    """
+
+    return [digests[i:i + DIGEST_SIZE] for i in range(0, len(digests), DIGEST_SIZE)]
+
+
+class HashingEngine(object):
+    """ Long-lived pool of worker processes that converts batches of passwords to raw NTLM digests. One engine is
+    shared by every stage of an audit, so the pool is only started once. The engine can also hash in a pool that is
+    shared with other work, in which case the owner of the pool closes it
+    """
+
+    def __init__(self, processes: int = None, pool: Pool = None):
+        self.processes = max(processes or cpu_count(), 1)
+        self.hash_count = 0
+        self.hash_time = 0.0
+        self._pool = pool
+        self._owns_pool = pool is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None and self._owns_pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @property
+    def hashes_per_second(self) -> float:
+        """ Average number of passwords hashed per second by the engine so far
         """
-        hasher = MD4.new()
-        hasher.update(input_string.encode('utf-16le'))
-        output = hasher.digest()
-        return binascii.hexlify(output).decode('utf-8').upper()
 
-    def _process_password(self, password: str) -> str:
-        return f'{self._hashify(password)}:0:{password}'
+        return self.hash_count / self.hash_time if self.hash_time else 0.0
 
-    def get_hashes(self, password_list: List[str]) -> List[str]:
-        """ Converts a list of strings to NTLM hashes using multiprocessing
+    def digest_batches(self, batches: Iterable[List[str]]) -> Iterator[Tuple[List[str], bytes]]:
+        """ Hash batches of passwords in the worker processes, yielding each batch with its digests in the order the
+        batches were given. Batches are read from the iterable as workers become free, so a generator of batches is
+        never held in memory in full. With a single process, batches are hashed in this process without a pool
 
         Args:
-            password_list: list of strings to convert to NTLM hashes
+            batches: lists of passwords to hash
         Returns:
-            List of NTLM hashes of the passwords
+            Generator of each batch and the concatenated digests of its passwords, from ntlm_digests
         """
-        with Pool(cpu_count()) as pool:
-            hashes = pool.map(self._process_password, password_list)
-        return hashes
+
+        start = time.perf_counter()
+        try:
+            if self.processes == 1:
+                for batch in batches:
+                    self.hash_count += len(batch)
+                    yield batch, ntlm_digests(batch)
+                return
+
+            if self._pool is None:
+                self._pool = Pool(self.processes)
+            pending = collections.deque()
+            for batch in batches:
+                pending.append((batch, self._pool.apply_async(ntlm_digests, (batch,))))
+                if len(pending) >= self.processes * 2:
+                    batch, result = pending.popleft()
+                    self.hash_count += len(batch)
+                    yield batch, result.get()
+            while pending:
+                batch, result = pending.popleft()
+                self.hash_count += len(batch)
+                yield batch, result.get()
+        finally:
+            self.hash_time += time.perf_counter() - start
+
+
+class Hashing(object):
+    """ Class to handle hashing and obfuscation of strings
+    """
+
+    def __init__(self):
+        self.salt = secrets.token_hex(8)
 
     def obfuscate(self, input_hash: str) -> str:
         """ Further hashes the input NTLM hash with a random salt
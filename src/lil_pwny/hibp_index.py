@@ -0,0 +1,224 @@
+import bisect
+import hashlib
+import io
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from lil_pwny.compression import open_binary
+from lil_pwny.file_encoding import detect_encoding
+from lil_pwny.exceptions import MalformedHIBPError, IndexFormatError
+
+INDEX_MAGIC = b'LPWNYIDX'
+INDEX_VERSION = 1
+
+# Header: magic, version, record size, record count, SHA-256 of the records, reserved
+HEADER_FORMAT = '<8sHHQ32s12x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Records: raw 16 byte NTLM digest followed by the number of occurrences in HIBP
+DIGEST_SIZE = 16
+COUNT_FORMAT = '<I'
+RECORD_SIZE = DIGEST_SIZE + struct.calcsize(COUNT_FORMAT)
+MAX_COUNT = 0xFFFFFFFF
+
+# Fan-out table: cumulative number of records for each 2 byte digest prefix
+FANOUT_PREFIX_BYTES = 2
+FANOUT_ENTRIES = 256 ** FANOUT_PREFIX_BYTES
+FANOUT_FORMAT = f'<{FANOUT_ENTRIES}Q'
+FANOUT_SIZE = struct.calcsize(FANOUT_FORMAT)
+RECORDS_OFFSET = HEADER_SIZE + FANOUT_SIZE
+
+
+def is_index(filepath: str) -> bool:
+    """ Check whether the given file is a Lil Pwny binary HIBP index
+
+    Args:
+        filepath: Path to the file to check
+    Returns:
+        True if the file starts with the index magic bytes
+    """
+
+    with open(filepath, 'rb') as f:
+        return f.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+
+
+def _parse_hibp_line(line: str) -> bytes:
+    """ Convert a "hash:occurrences" line from the HIBP file to a packed index record
+
+    Args:
+        line: line from the HIBP file
+    Returns:
+        Packed record containing the raw digest and occurrence count
+    """
+
+    try:
+        ntlm_hash, count = line.strip().split(':')[:2]
+        digest = bytes.fromhex(ntlm_hash)
+        if len(digest) != DIGEST_SIZE:
+            raise ValueError
+        return digest + struct.pack(COUNT_FORMAT, min(int(count), MAX_COUNT))
+    except ValueError:
+        raise MalformedHIBPError(line.strip())
+
+
+def build_index(hibp_filepath: str, index_filepath: str, encoding: str = None) -> int:
+    """ Convert a text HIBP file of "hash:occurrences" lines into a sorted binary index.
+
+    The input does not need to be ordered by hash, and can be compressed with gzip, xz or bz2. Records are first
+    split into one temporary bucket per leading digest byte, then each bucket is sorted in memory and appended to the
+    index.
+
+    Args:
+        hibp_filepath: Path to the text HIBP file, which may be compressed
+        index_filepath: Path to write the index to
+        encoding: Encoding of the HIBP file. Detected from the start of the file if not given
+    Returns:
+        Number of records written to the index
+    """
+
+    encoding = encoding or detect_encoding(hibp_filepath)
+
+    index_dir = os.path.dirname(os.path.abspath(index_filepath))
+    with tempfile.TemporaryDirectory(dir=index_dir) as bucket_dir:
+        buckets = [open(os.path.join(bucket_dir, f'{i:02x}'), 'wb') for i in range(256)]
+        input_sorted = True
+        previous_record = b''
+        try:
+            with io.TextIOWrapper(open_binary(hibp_filepath), encoding=encoding) as infile:
+                for line in infile:
+                    if not line.strip():
+                        continue
+                    record = _parse_hibp_line(line)
+                    if record < previous_record:
+                        input_sorted = False
+                    previous_record = record
+                    buckets[record[0]].write(record)
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        fanout = []
+        record_count = 0
+        checksum = hashlib.sha256()
+        with open(index_filepath, 'wb') as outfile:
+            outfile.write(b'\0' * RECORDS_OFFSET)
+            for first_byte, bucket in enumerate(buckets):
+                data = Path(bucket.name).read_bytes()
+                os.remove(bucket.name)
+                records = [data[i:i + RECORD_SIZE] for i in range(0, len(data), RECORD_SIZE)]
+                if not input_sorted:
+                    records.sort()
+                for second_byte in range(1, 256):
+                    fanout.append(record_count + bisect.bisect_left(records, bytes([first_byte, second_byte])))
+                record_count += len(records)
+                fanout.append(record_count)
+
+                data = b''.join(records)
+                checksum.update(data)
+                outfile.write(data)
+
+            outfile.seek(0)
+            outfile.write(struct.pack(
+                HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, RECORD_SIZE, record_count, checksum.digest()))
+            outfile.write(struct.pack(FANOUT_FORMAT, *fanout))
+
+    return record_count
+
+
+class HIBPIndex:
+    """ Read-only, memory-mapped view of a binary HIBP index created with build_index
+    """
+
+    def __init__(self, index_filepath: str):
+        self.filepath = index_filepath
+        self._file = open(index_filepath, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise IndexFormatError(index_filepath, 'Index file is empty')
+
+        try:
+            self._read_header()
+        except IndexFormatError:
+            self.close()
+            raise
+
+    def _read_header(self) -> None:
+        """ Validate the header and load the fan-out table
+        """
+
+        if len(self._mm) < RECORDS_OFFSET:
+            raise IndexFormatError(self.filepath, 'Index file is truncated')
+        magic, version, record_size, self.record_count, self.checksum = struct.unpack_from(
+            HEADER_FORMAT, self._mm)
+        if magic != INDEX_MAGIC:
+            raise IndexFormatError(self.filepath, 'File is not a Lil Pwny HIBP index')
+        if version != INDEX_VERSION or record_size != RECORD_SIZE:
+            raise IndexFormatError(self.filepath, f'Unsupported index version {version}')
+        if len(self._mm) != RECORDS_OFFSET + self.record_count * RECORD_SIZE:
+            raise IndexFormatError(self.filepath, 'Index file size does not match the header')
+
+        self._fanout = struct.unpack_from(FANOUT_FORMAT, self._mm, HEADER_SIZE)
+        if self._fanout[-1] != self.record_count:
+            raise IndexFormatError(self.filepath, 'Index fan-out table does not match the header')
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def verify(self) -> bool:
+        """ Check the records against the checksum stored in the header
+
+        Returns:
+            True if the checksum matches
+        """
+
+        checksum = hashlib.sha256()
+        for offset in range(RECORDS_OFFSET, len(self._mm), RECORD_SIZE * 65536):
+            checksum.update(self._mm[offset:min(offset + RECORD_SIZE * 65536, len(self._mm))])
+        return checksum.digest() == self.checksum
+
+    def lookup(self, ntlm_hash: str) -> Optional[int]:
+        """ Look up an NTLM hash in the index
+
+        Args:
+            ntlm_hash: NTLM hash as a hex string
+        Returns:
+            Number of occurrences of the hash in HIBP, or None if it is not in the index
+        """
+
+        try:
+            digest = bytes.fromhex(ntlm_hash)
+        except ValueError:
+            return None
+        if len(digest) != DIGEST_SIZE:
+            return None
+
+        prefix = int.from_bytes(digest[:FANOUT_PREFIX_BYTES], 'big')
+        low = self._fanout[prefix - 1] if prefix else 0
+        high = self._fanout[prefix]
+        while low < high:
+            middle = (low + high) // 2
+            offset = RECORDS_OFFSET + middle * RECORD_SIZE
+            record_digest = self._mm[offset:offset + DIGEST_SIZE]
+            if record_digest < digest:
+                low = middle + 1
+            elif record_digest > digest:
+                high = middle
+            else:
+                return struct.unpack_from(COUNT_FORMAT, self._mm, offset + DIGEST_SIZE)[0]
+        return None
@@ -3,22 +3,118 @@ import dataclasses
 import json
 import logging
 import logging.handlers
+import atexit
 import os
+import queue
 import re
 import sys
+import threading
 import traceback
 from logging import Logger
-from typing import Any, Dict, List, ClassVar, Protocol
+from typing import Any, Dict, List, ClassVar, Protocol, TextIO, Tuple
 from multiprocessing import Queue
 
 from colorama import Fore, Back, Style, init
 
 
+# Number of lines OutputWriter joins into a single write
+OUTPUT_BATCH_SIZE = 1000
+# Colour, style and symbol of each type of stdout message. Other types are white and keep their name as the symbol
+STDOUT_STYLES = {
+    'NOTIFY': (Fore.CYAN, Style.NORMAL, 'NOTIFY'),
+    'INFO': (Fore.WHITE, Style.DIM, '-'),
+    'HIBP': (Fore.RED, Style.NORMAL, '!'),
+    'DEBUG': (Fore.WHITE, Style.DIM, '#'),
+    'ERROR': (Fore.MAGENTA, Style.NORMAL, 'ERROR'),
+    'WARNING': (Fore.YELLOW, Style.NORMAL, '!'),
+    'SUCCESS': (Fore.LIGHTGREEN_EX, Style.NORMAL, '>>'),
+    'DUPLICATE': (Fore.LIGHTGREEN_EX, Style.NORMAL, '!'),
+    'CUSTOM': (Fore.YELLOW, Style.NORMAL, '!'),
+    'METRICS': (Fore.WHITE, Style.DIM, '-'),
+    'USERNAME': (Fore.BLUE, Style.NORMAL, '!'),
+}
+# Log level word/symbol and header words of stdout messages, which are coloured
+TYPE_COLORER = re.compile(r'([A-Z]{3,})')
+HEADER_WORDS = re.compile(r'([A-Z_0-9]{2,}:)\s')
+
+
+def _stdout_line_format(mes_type: str) -> Tuple[str, str]:
+    """ Build the start of a stdout line for a type of message, and the replacement that colours its header words
+
+    Args:
+        mes_type: type of message
+    Returns:
+        The start of the line, and the replacement for HEADER_WORDS
+    """
+
+    color, style, symbol = STDOUT_STYLES.get(mes_type, (Fore.WHITE, Style.NORMAL, mes_type))
+    reset_all = Style.NORMAL + Fore.RESET + Back.RESET
+    symbol = TYPE_COLORER.sub(color + r'\1' + color, symbol.lower())
+    prefix = f'{reset_all}{style}[{color}{symbol}{Fore.WHITE}]{style} '
+    return prefix, color + Style.BRIGHT + r'\1 ' + Fore.WHITE + Style.NORMAL
+
+
+class OutputWriter(object):
+    """ File-like object that writes to a stream from a single background thread.
+
+    Writes from any thread or stage of the audit are queued and return immediately. The writer thread joins the
+    queued text into batches of up to OUTPUT_BATCH_SIZE writes, and writes and flushes each batch at once, so large
+    numbers of findings do not slow the search with a write and flush for each line. The writer is closed when the
+    interpreter exits, after everything queued has been written.
+    """
+
+    def __init__(self, stream: TextIO, batch_size: int = OUTPUT_BATCH_SIZE):
+        self.stream = stream
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_batches, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, text: str) -> None:
+        self._queue.put(text)
+
+    def flush(self) -> None:
+        """ Batches are flushed by the writer thread, so there is nothing to flush when a caller writes a line
+        """
+
+    def isatty(self) -> bool:
+        return self.stream.isatty()
+
+    def close(self) -> None:
+        """ Write everything that has been queued, then stop the writer thread
+        """
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _write_batches(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closed = None in batch
+            self.stream.write(''.join(text for text in batch if text is not None))
+            self.stream.flush()
+            if closed:
+                return
+
+
 class StdoutLogger:
     def __init__(self, **kwargs):
         self.debug = kwargs.get('debug')
+        # Results file that findings are written to instead of stdout, if one is set
+        self.sink = kwargs.get('sink')
+        # Start of the line and header word replacement for each type of message, built when it is first logged
+        self._line_formats = {}
         self.print_header()
         init()
+        # stdout is wrapped by colorama's init, so it is only looked up afterwards
+        self.stream = OutputWriter(sys.stdout) if kwargs.get('asynchronous') else sys.stdout
 
     def log(self,
             mes_type: str,
@@ -30,9 +126,20 @@ class StdoutLogger:
         if not self.debug and mes_type == 'DEBUG':
             return
 
+        if mes_type == 'NOTIFY' and self.sink is not None:
+            self.sink.write(notify_type, message)
+            return
+
         if dataclasses.is_dataclass(message):
             message = dataclasses.asdict(message)
 
+        # Findings from audits of several AD user files are tagged with the file they came from
+        source = ''
+        if notify_type == 'duplicate' and message.get('sources'):
+            source = f' SOURCES: {message.get("sources")}'
+        elif notify_type and message.get('source'):
+            source = f' SOURCE: {message.get("source")}'
+
         if notify_type == "hibp":
             message = (f'HIBP_MATCH: \n'
                        f'    ACCOUNT: {message.get("username").lower()}  HASH: {message.get("hash")} '
@@ -50,6 +157,9 @@ class StdoutLogger:
             message = 'DUPLICATE: \n' \
                       f'    ACCOUNTS: {message.get("users")} HASH: {message.get("hash")} OBFUSCATED: {message.get("obfuscated")}'
             mes_type = 'DUPLICATE'
+        message = f'{message}{source}' if source else message
+        if mes_type == 'METRICS':
+            message = f'METRICS: {_json_encoder.encode(message)}'
         try:
             self.log_to_stdout(message, mes_type)
         except Exception as e:
@@ -61,80 +171,12 @@ class StdoutLogger:
                       mes_type: str) -> None:
 
         try:
-
-            reset_all = Style.NORMAL + Fore.RESET + Back.RESET
-            key_color = Fore.WHITE
-            base_color = Fore.WHITE
-            high_color = Fore.WHITE
-            style = Style.NORMAL
-
-            if mes_type == "NOTIFY":
-                base_color = Fore.CYAN
-                high_color = Fore.CYAN
-                key_color = Fore.CYAN
-                style = Style.NORMAL
-            elif mes_type == 'INFO':
-                base_color = Fore.WHITE
-                high_color = Fore.WHITE
-                key_color = Fore.WHITE
-                style = Style.DIM
-                mes_type = '-'
-            elif mes_type == 'HIBP':
-                base_color = Fore.RED
-                high_color = Fore.RED
-                key_color = Fore.RED
-                style = Style.NORMAL
-                mes_type = '!'
-            elif mes_type == "DEBUG":
-                base_color = Fore.WHITE
-                high_color = Fore.WHITE
-                key_color = Fore.WHITE
-                style = Style.DIM
-                mes_type = '#'
-            elif mes_type == "ERROR":
-                base_color = Fore.MAGENTA
-                high_color = Fore.MAGENTA
-                key_color = Fore.MAGENTA
-                style = Style.NORMAL
-            elif mes_type == 'WARNING':
-                base_color = Fore.YELLOW
-                high_color = Fore.YELLOW
-                key_color = Fore.YELLOW
-                style = Style.NORMAL
-                mes_type = '!'
-            elif mes_type == "SUCCESS":
-                base_color = Fore.LIGHTGREEN_EX
-                high_color = Fore.LIGHTGREEN_EX
-                key_color = Fore.LIGHTGREEN_EX
-                style = Style.NORMAL
-                mes_type = '>>'
-            elif mes_type == "DUPLICATE":
-                base_color = Fore.LIGHTGREEN_EX
-                high_color = Fore.LIGHTGREEN_EX
-                key_color = Fore.LIGHTGREEN_EX
-                style = Style.NORMAL
-                mes_type = '!'
-            elif mes_type == "CUSTOM":
-                base_color = Fore.YELLOW
-                high_color = Fore.YELLOW
-                key_color = Fore.YELLOW
-                style = Style.NORMAL
-                mes_type = '!'
-            elif mes_type == "USERNAME":
-                base_color = Fore.BLUE
-                high_color = Fore.BLUE
-                key_color = Fore.BLUE
-                style = Style.NORMAL
-                mes_type = '!'
-
-            # Make log level word/symbol coloured
-            type_colorer = re.compile(r'([A-Z]{3,})', re.VERBOSE)
-            mes_type = type_colorer.sub(high_color + r'\1' + base_color, mes_type.lower())
-            # Make header words coloured
-            header_words = re.compile(r'([A-Z_0-9]{2,}:)\s', re.VERBOSE)
-            message = header_words.sub(key_color + Style.BRIGHT + r'\1 ' + Fore.WHITE + Style.NORMAL, str(message))
-            sys.stdout.write(
-                f"{reset_all}{style}[{base_color}{mes_type}{Fore.WHITE}]{style} {message}{Fore.WHITE}{Style.NORMAL}\n")
+            line_format = self._line_formats.get(mes_type)
+            if line_format is None:
+                line_format = self._line_formats[mes_type] = _stdout_line_format(mes_type)
+            prefix, header_replacement = line_format
+            message = HEADER_WORDS.sub(header_replacement, str(message))
+            self.stream.write(f'{prefix}{message}{Fore.WHITE}{Style.NORMAL}\n')
         except Exception:
             if self.debug:
                 traceback.print_exc()
@@ -199,8 +241,26 @@ class EnhancedJSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+# Shared encoder, so one isn't created for every record
+_json_encoder = EnhancedJSONEncoder()
+
+
+class _RecordTypeFormatter(logging.Formatter):
+    """ Formats each record with the formatter for its record type, so the formatter of the handler doesn't have to
+    be swapped for every record
+    """
+
+    def __init__(self, formatters: Dict[str, logging.Formatter], default: logging.Formatter):
+        super().__init__()
+        self.formatters = formatters
+        self.default = default
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.formatters.get(getattr(record, 'record_type', None), self.default).format(record)
+
+
 class JSONLogger(Logger):
-    def __init__(self, name: str = 'lil pwny', log_queue: Queue = None, **kwargs):
+    def __init__(self, name: str = 'lil pwny', log_queue: Queue = None, stream: TextIO = None, **kwargs):
         super().__init__(name)
         self.notify_format = logging.Formatter(
             '{"localtime": "%(asctime)s", "level": "NOTIFY", "source": "%(name)s", "match_type": "%(type)s", '
@@ -208,40 +268,53 @@ class JSONLogger(Logger):
         self.success_format = logging.Formatter(
             '{"localtime": "%(asctime)s", "level": "SUCCESS", "source": "%(name)s", '
             '"detection_data": %(message)s}')
+        self.metrics_format = logging.Formatter(
+            '{"localtime": "%(asctime)s", "level": "METRICS", "source": "%(name)s", "metrics": %(message)s}')
+        self.progress_format = logging.Formatter(
+            '{"localtime": "%(asctime)s", "level": "PROGRESS", "source": "%(name)s", "progress": %(message)s}')
         self.info_format = logging.Formatter(
             '{"localtime": "%(asctime)s", "level": "%(levelname)s", "source": "%(name)s", "message":'
             ' %(message)s}')
 
-        self.logger = logging.getLogger(name)
+        if kwargs.get('asynchronous') and not log_queue:
+            stream = OutputWriter(stream or sys.stdout)
+        # Loggers writing to their own stream are not registered globally, so their handlers don't accumulate
+        self.logger = logging.getLogger(name) if stream is None else logging.Logger(name)
 
         if log_queue:
             self.handler = logging.handlers.QueueHandler(log_queue)
         else:
-            self.handler = logging.StreamHandler(sys.stdout)
+            self.handler = logging.StreamHandler(stream or sys.stdout)
+        self.handler.setFormatter(_RecordTypeFormatter(
+            {
+                'NOTIFY': self.notify_format,
+                'SUCCESS': self.success_format,
+                'METRICS': self.metrics_format,
+                'PROGRESS': self.progress_format
+            },
+            default=self.info_format))
 
         self.logger.addHandler(self.handler)
         if kwargs.get('debug'):
             self.logger.setLevel(logging.DEBUG)
         else:
             self.logger.setLevel(logging.INFO)
+        # Results file that findings are written to instead of the log, if one is set
+        self.sink = kwargs.get('sink')
 
     def log(self, level: str, log_data: str or Dict, **kwargs):
-        if level.upper() == 'NOTIFY':
-            self.handler.setFormatter(self.notify_format)
-            self.logger.info(
-                json.dumps(log_data, cls=EnhancedJSONEncoder),
-                extra={'type': kwargs.get('notify_type', '')})
-        elif level.upper() == 'SUCCESS':
-            self.handler.setFormatter(self.success_format)
+        level = level.upper()
+        if level == 'NOTIFY' and self.sink is not None:
+            self.sink.write(kwargs.get('notify_type', ''), log_data)
+            return
+        if level in ['NOTIFY', 'SUCCESS', 'METRICS', 'PROGRESS']:
             self.logger.info(
-                json.dumps(log_data, cls=EnhancedJSONEncoder),
-                extra={'type': kwargs.get('notify_type', '')})
-        elif level.upper() in ['INFO', 'DEBUG']:
-            self.handler.setFormatter(self.info_format)
-            self.logger.log(getattr(logging, level.upper()), json.dumps(log_data))
+                _json_encoder.encode(log_data),
+                extra={'record_type': level, 'type': kwargs.get('notify_type', '')})
+        elif level in ['INFO', 'DEBUG']:
+            self.logger.log(getattr(logging, level), _json_encoder.encode(log_data))
         else:
-            self.handler.setFormatter(self.info_format)
-            self.logger.critical(log_data)
+            self.logger.critical(_json_encoder.encode(log_data))
 
 
 class IsDataclass(Protocol):
@@ -0,0 +1,116 @@
+import contextlib
+import dataclasses
+import sys
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+@dataclasses.dataclass
+class StageMetrics:
+    """ Timing and throughput of one stage of an audit. Stages that run more than once, such as output, accumulate
+    """
+
+    name: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    bytes: int = 0
+    lines: int = 0
+    blocks: int = 0
+    worker_busy_seconds: Dict[str, float] = dataclasses.field(default_factory=dict)
+    counters: Dict[str, float] = dataclasses.field(default_factory=dict)
+    peak_rss_kb: Optional[int] = None
+    children_peak_rss_kb: Optional[int] = None
+
+    def add_worker_time(self, worker: int, seconds: float) -> None:
+        """ Add time that a worker process spent busy on this stage
+
+        Args:
+            worker: process ID of the worker
+            seconds: seconds the worker was busy
+        """
+
+        key = str(worker)
+        self.worker_busy_seconds[key] = self.worker_busy_seconds.get(key, 0.0) + seconds
+
+    def add_hashing(self, hash_count: int, hash_seconds: float) -> None:
+        """ Record passwords hashed during this stage
+
+        Args:
+            hash_count: number of passwords hashed
+            hash_seconds: seconds spent hashing them
+        """
+
+        self.counters['hashes'] = self.counters.get('hashes', 0) + hash_count
+        self.counters['hash_seconds'] = self.counters.get('hash_seconds', 0.0) + hash_seconds
+        if self.counters['hash_seconds']:
+            self.counters['hashes_per_second'] = self.counters['hashes'] / self.counters['hash_seconds']
+
+
+def _thread_cpu_seconds() -> float:
+    """ CPU time used by the calling thread. Stages of an audit run in different threads at the same time, so the CPU
+    time of the whole process would also count the work of the other stages
+    """
+
+    return time.thread_time()
+
+
+def _peak_rss_kb() -> Tuple[Optional[int], Optional[int]]:
+    """ Peak resident set size of this process, and of the largest of its worker processes that have exited, in KB
+    """
+
+    if resource is None:
+        return None, None
+    scale = 1 / 1024 if sys.platform == 'darwin' else 1
+    return (int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale),
+            int(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale))
+
+
+class AuditMetrics:
+    """ Collects StageMetrics for each stage of an audit.
+
+    CPU time is measured for the thread running the stage, plus the time worker processes spent busy on the stage,
+    so stages that run at the same time are not counted twice.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """ Time a stage of the audit
+
+        Args:
+            name: name of the stage
+        Returns:
+            Context manager giving the StageMetrics of the stage, for recording bytes, lines and other counters
+        """
+
+        stage = self.stages.setdefault(name, StageMetrics(name))
+        wall_start = time.perf_counter()
+        cpu_start = _thread_cpu_seconds()
+        worker_start = sum(stage.worker_busy_seconds.values())
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds += time.perf_counter() - wall_start
+            stage.cpu_seconds += (_thread_cpu_seconds() - cpu_start
+                                  + sum(stage.worker_busy_seconds.values()) - worker_start)
+            stage.peak_rss_kb, stage.children_peak_rss_kb = _peak_rss_kb()
+
+    def to_dict(self) -> Dict:
+        """ Metrics of every stage, in the order the stages first ran
+
+        Returns:
+            Dict of the total wall time and the metrics of each stage
+        """
+
+        return {
+            'total_wall_seconds': time.perf_counter() - self._start,
+            'stages': [dataclasses.asdict(stage) for stage in self.stages.values()]
+        }
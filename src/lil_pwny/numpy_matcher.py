@@ -0,0 +1,89 @@
+from typing import Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from lil_pwny.exceptions import MalformedHIBPError
+
+# Number of leading hex characters of each hash that are decoded into a 64-bit key
+KEY_HEX_LENGTH = 16
+SEPARATOR_OFFSET = 32
+
+if np is not None:
+    HEX_VALUES = np.full(256, 255, dtype=np.uint64)
+    for _value, _char in enumerate('0123456789abcdef'):
+        HEX_VALUES[ord(_char)] = HEX_VALUES[ord(_char.upper())] = _value
+
+
+def is_available() -> bool:
+    """ Check whether NumPy is installed, which is required for the vectorised matcher
+
+    Returns:
+        True if NumPy can be imported
+    """
+
+    return np is not None
+
+
+def hash_keys(ntlm_hashes: Iterable[str]) -> 'np.ndarray':
+    """ Convert NTLM hashes into a sorted array of 64-bit keys made from their first 16 hex characters
+
+    Args:
+        ntlm_hashes: NTLM hashes as hex strings
+    Returns:
+        Sorted uint64 array of keys
+    """
+
+    keys = []
+    for ntlm_hash in ntlm_hashes:
+        try:
+            keys.append(int(ntlm_hash[:KEY_HEX_LENGTH], 16))
+        except ValueError:
+            continue
+    return np.unique(np.array(keys, dtype=np.uint64))
+
+
+def find_candidate_lines(block: bytes, keys: 'np.ndarray') -> List[Tuple[int, int]]:
+    """ Find the lines in a block of a "hash:occurrences" file whose hash could be one of the given keys.
+
+    Every line is decoded with vectorised operations: the hex characters at fixed offsets from the start of each line
+    are converted to a 64-bit key and matched against the sorted keys with a binary search. Only the lines that match
+    are returned, and these still need to be checked against the full hash.
+
+    Args:
+        block: raw ASCII-compatible bytes of the block, aligned to the start of a line
+        keys: sorted keys of the hashes to search for, from hash_keys
+    Returns:
+        List of (start, end) offsets within the block of each candidate line
+    """
+
+    if not block:
+        return []
+
+    data = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(data)]))
+
+    well_formed = (ends - starts) > SEPARATOR_OFFSET
+    offsets = np.where(well_formed, starts, 0)
+    well_formed &= data[offsets + SEPARATOR_OFFSET * well_formed] == ord(':')
+
+    line_keys = np.zeros(len(starts), dtype=np.uint64)
+    for i in range(KEY_HEX_LENGTH):
+        values = HEX_VALUES[data[offsets + i * well_formed]]
+        well_formed &= values != 255
+        line_keys = (line_keys << np.uint64(4)) | (values & np.uint64(15))
+
+    for i in np.flatnonzero(~well_formed):
+        line = block[starts[i]:ends[i]].strip()
+        if line:
+            raise MalformedHIBPError(line.decode(errors='replace'))
+
+    if not len(keys):
+        return []
+    positions = np.minimum(np.searchsorted(keys, line_keys), len(keys) - 1)
+    candidates = np.flatnonzero(well_formed & (keys[positions] == line_keys))
+    return [(int(starts[i]), int(ends[i])) for i in candidates]
@@ -0,0 +1,103 @@
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from Crypto.Hash import MD4
+
+# Longest UTF-16LE password, in bytes, that fits in a single MD4 block with the padding byte and 8 byte length
+MAX_BLOCK_PASSWORD_BYTES = 55
+BLOCK_SIZE = 64
+DIGEST_SIZE = 16
+
+INITIAL_STATE = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476)
+ROUND_2_CONSTANT = 0x5A827999
+ROUND_3_CONSTANT = 0x6ED9EBA1
+# Message word used by each step, and the rotation used by each step in a group of four, for each round
+ROUND_1_WORDS = list(range(16))
+ROUND_2_WORDS = [0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15]
+ROUND_3_WORDS = [0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15]
+ROUND_1_SHIFTS = [3, 7, 11, 19]
+ROUND_2_SHIFTS = [3, 5, 9, 13]
+ROUND_3_SHIFTS = [3, 9, 11, 15]
+
+
+def is_available() -> bool:
+    """ Check whether NumPy is installed, which is required for the vectorised NTLM hashing
+
+    Returns:
+        True if NumPy can be imported
+    """
+
+    return np is not None
+
+
+def _rotate_left(values: 'np.ndarray', shift: int) -> 'np.ndarray':
+    return (values << np.uint32(shift)) | (values >> np.uint32(32 - shift))
+
+
+def _md4_single_block(words: 'np.ndarray') -> 'np.ndarray':
+    """ Run the MD4 compression function over one padded 64 byte block per row
+
+    Args:
+        words: uint32 array of shape (n, 16) holding the little-endian words of each block
+    Returns:
+        uint32 array of shape (n, 4) holding the state words of each digest
+    """
+
+    x = [np.ascontiguousarray(words[:, i]) for i in range(16)]
+    state = [np.full(len(words), value, dtype=np.uint32) for value in INITIAL_STATE]
+    a, b, c, d = state
+
+    for step, word in enumerate(ROUND_1_WORDS):
+        a = _rotate_left(a + ((b & c) | (~b & d)) + x[word], ROUND_1_SHIFTS[step % 4])
+        a, b, c, d = d, a, b, c
+    for step, word in enumerate(ROUND_2_WORDS):
+        a = _rotate_left(a + ((b & c) | (b & d) | (c & d)) + x[word] + np.uint32(ROUND_2_CONSTANT),
+                         ROUND_2_SHIFTS[step % 4])
+        a, b, c, d = d, a, b, c
+    for step, word in enumerate(ROUND_3_WORDS):
+        a = _rotate_left(a + (b ^ c ^ d) + x[word] + np.uint32(ROUND_3_CONSTANT), ROUND_3_SHIFTS[step % 4])
+        a, b, c, d = d, a, b, c
+
+    return np.stack([a + state[0], b + state[1], c + state[2], d + state[3]], axis=1)
+
+
+def ntlm_digests(passwords: List[str]) -> bytes:
+    """ Converts a batch of passwords to raw NTLM digests with vectorised operations.
+
+    Every password short enough to fit in a single MD4 block is packed into a row of a uint32 matrix, and the MD4
+    rounds are run on the columns of the matrix. Longer passwords are hashed one at a time with pycryptodome.
+
+    Args:
+        passwords: passwords to hash
+    Returns:
+        The 16 byte digest of each password, concatenated in the same order as the passwords
+    """
+
+    encoded = [password.encode('utf-16le') for password in passwords]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    digests = np.zeros((len(encoded), DIGEST_SIZE), dtype=np.uint8)
+
+    single_block = np.flatnonzero(lengths <= MAX_BLOCK_PASSWORD_BYTES)
+    if len(single_block):
+        block_lengths = lengths[single_block]
+        data = np.frombuffer(b''.join(encoded[i] for i in single_block), dtype=np.uint8)
+        rows = np.repeat(np.arange(len(single_block)), block_lengths)
+        row_starts = np.cumsum(block_lengths) - block_lengths
+        columns = np.arange(len(data)) - np.repeat(row_starts, block_lengths)
+
+        blocks = np.zeros((len(single_block), BLOCK_SIZE), dtype=np.uint8)
+        blocks[rows, columns] = data
+        blocks[np.arange(len(single_block)), block_lengths] = 0x80
+        blocks[:, BLOCK_SIZE - 8:] = (block_lengths * 8).astype('<u8').view(np.uint8).reshape(-1, 8)
+
+        state = _md4_single_block(blocks.view('<u4'))
+        digests[single_block] = state.astype('<u4').view(np.uint8).reshape(-1, DIGEST_SIZE)
+
+    for i in np.flatnonzero(lengths > MAX_BLOCK_PASSWORD_BYTES):
+        digests[i] = np.frombuffer(MD4.new(encoded[i]).digest(), dtype=np.uint8)
+
+    return digests.tobytes()
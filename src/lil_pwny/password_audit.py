@@ -1,15 +1,50 @@
-import gc
+import codecs
+import collections
+import itertools
+import mmap
 import os
+import queue
+import re
+import time
 import multiprocessing as mp
-from typing import List, Dict, TextIO
+from multiprocessing.pool import Pool
+from typing import Any, List, Dict, Tuple, Optional, Iterator, Iterable
 from pathlib import Path
 
-from charset_normalizer import from_bytes
-
-from lil_pwny.hashing import Hashing
+from lil_pwny import compression, hibp_index, numpy_matcher
+from lil_pwny.file_encoding import detect_encoding, is_ascii_compatible
+from lil_pwny.hashing import HASH_BATCH_SIZE, Hashing, HashingEngine, split_digests
+from lil_pwny.result_cache import ResultCache
 from lil_pwny.loggers import JSONLogger, StdoutLogger
+from lil_pwny.metrics import StageMetrics
+from lil_pwny.progress import ScanProgress
+from lil_pwny.variant_cache import VariantHashCache
+from lil_pwny.variant_generators.custom_variant_generator import CustomVariantGenerator
+from lil_pwny.variant_generators.username_variant_generator import UsernameVariantGenerator
+from lil_pwny.worker_pool import WorkerPool
 from lil_pwny.exceptions import MalformedHIBPError
 
+# Matches the start of a line in a "hash:occurrences" file
+HASH_LINE_PATTERN = re.compile(rb'^[0-9A-Fa-f]{32}:')
+# HASH_LINE_PATTERN for lines that have been decoded
+HASH_TEXT_PATTERN = re.compile(HASH_LINE_PATTERN.pattern.decode('ascii'))
+# Matches the first non-blank line of a block
+FIRST_LINE_PATTERN = re.compile(rb'\s*(\S[^\r\n]*)?')
+NTLM_HASH_LENGTH = 32
+SORT_CHECK_SAMPLES = 1024
+DEFAULT_BLOCK_SIZE = 100
+DEFAULT_WORKERS = max(mp.cpu_count() - 1, 1)
+SCAN_ENGINES = ['auto', 'python', 'numpy', 'merge']
+# Consecutive non-matching lines the merge join reads before it binary searches ahead to the next AD hash
+MERGE_GALLOP_LINES = 64
+# Largest chunk in MB that compressed files are decompressed into for scanning, to bound the memory of chunks in flight
+COMPRESSED_CHUNK_SIZE = 16
+# Number of leading hex characters (24 bits) of each hash checked by the prefix filter
+PREFIX_FILTER_LENGTH = 6
+
+# Per-process state set by the pool initializer for _multi_pro_search workers
+_worker_state = {}
+
 
 def _sanitize_filepath(filepath: str) -> str:
     """ Check if the file path is valid
@@ -26,27 +61,97 @@ def _sanitize_filepath(filepath: str) -> str:
     return str(path)
 
 
-def import_users(filepath: str) -> Dict[str, List[str]]:
-    """ Import Active Directory users from text file into a dict
+class SourcedUsername(str):
+    """ Username of an AD user that also records the AD user file it was loaded from, so findings can be tagged with
+    their source when several AD user files are audited together. It is used anywhere a username string is
+    """
+
+    def __new__(cls, username: str, source: str):
+        sourced_username = super().__new__(cls, username)
+        sourced_username.source = source
+        return sourced_username
+
+    def __reduce__(self):
+        return SourcedUsername, (str(self), self.source)
+
+
+def ad_user_files(paths: Iterable[str]) -> List[str]:
+    """ Expand AD user file paths, replacing each directory with the files in it
+
+    Args:
+        paths: paths of AD user files or directories containing them
+    Returns:
+        List of AD user file paths, with the files in each directory in name order
+    """
+
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if not name.startswith('.') and os.path.isfile(os.path.join(path, name)))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+
+def import_user_files(filepaths: List[str], encoding: str = None) -> Dict[str, List[str]]:
+    """ Import Active Directory users from several AD user files, such as dumps of different forests, into one dict
+    so every file is audited in a single pass over the HIBP file. Each username records the file it came from
+
+    Args:
+        filepaths: paths of the AD user files
+        encoding: encoding of the files. Detected from the start of each file if not given
+    Returns:
+        Dict with the key as the NTLM hash, value is a list containing SourcedUsernames of users matching that hash
+    """
+
+    users = {}
+    for filepath in filepaths:
+        for ntlm_hash, usernames in import_users(filepath, encoding=encoding).items():
+            users.setdefault(ntlm_hash, []).extend(SourcedUsername(username, filepath) for username in usernames)
+    return users
+
+
+def import_users(filepath: str, encoding: str = None) -> Dict[str, List[str]]:
+    """ Import Active Directory users from text file into a dict. The file is read in a single streaming pass
 
     Args:
         filepath: Path for the AD user file
+        encoding: Encoding of the file. Detected from the start of the file if not given
     Returns:
         Dict with the key as the NTLM hash, value is a list containing users matching that hash
     """
 
-    users = {}
     filepath = _sanitize_filepath(filepath)
-
-    with open(filepath, 'rb') as infile:
-        raw_data = infile.read()
-        encoding = from_bytes(raw_data).best().encoding
+    encoding = encoding or detect_encoding(filepath)
 
     with open(filepath, encoding=encoding) as infile:
-        for u in _nonblank_lines(infile):
-            username, pwd_hash = u.strip().split(':')[0].upper(), u.strip().split(':')[1].upper()
-            if not username.endswith('$'):
-                users.setdefault(pwd_hash, []).append(username)
+        return parse_users(infile)
+
+
+def parse_users(lines: Iterable[str]) -> Dict[str, List[str]]:
+    """ Parse Active Directory users into a dict. Lines can be in either the DSInternals HashcatNT format "user:hash"
+    or the secretsdump format "user:rid:lmhash:nthash:::". Computer accounts are skipped
+
+    Args:
+        lines: Lines of AD user data
+    Returns:
+        Dict with the key as the NTLM hash, value is a list containing users matching that hash
+    """
+
+    users = {}
+    for line_number, u in enumerate(lines, start=1):
+        fields = u.strip().upper().split(':')
+        if fields == ['']:
+            continue
+        if len(fields) >= 4:
+            username, pwd_hash = fields[0], fields[3]
+        elif len(fields) >= 2:
+            username, pwd_hash = fields[0], fields[1]
+        else:
+            raise ValueError(f'Line {line_number} of the AD user file is not in the format "user:hash"')
+        if not username.endswith('$'):
+            users.setdefault(pwd_hash, []).append(username)
 
     return users
 
@@ -74,6 +179,8 @@ def find_duplicates(ad_hash_dict: Dict, obfuscated: bool) -> List[dict]:
                 'users': duplicate_users,
                 'obfuscated': obfuscated
             }
+            if isinstance(duplicate_users[0], SourcedUsername):
+                output['sources'] = [user.source for user in duplicate_users]
             results_list.append(output)
 
     return results_list
@@ -83,64 +190,763 @@ def search(log_handler: JSONLogger or StdoutLogger,
            hibp_hashes_filepath: str,
            ad_user_hashes: Dict[str, List[str]],
            finding_type: str,
-           obfuscated: bool) -> List[dict]:
+           obfuscated: bool,
+           sorted_lookup: bool = True,
+           workers: int = DEFAULT_WORKERS,
+           block_size: int = DEFAULT_BLOCK_SIZE,
+           engine: str = 'auto',
+           encoding: str = None,
+           cache: ResultCache = None,
+           metrics: StageMetrics = None,
+           pool: WorkerPool = None) -> List[dict]:
     """ Search for AD users in the HIBP file
 
+    If the file is a binary HIBP index, or a text file ordered by hash, each AD hash is looked up with a binary
+    search of the memory-mapped file. With the merge engine, text files ordered by hash are instead merge joined
+    against the sorted AD hashes in parallel hash ranges. Otherwise the whole file is scanned in parallel blocks.
+
     Args:
         log_handler: logger instance for outputting
         hibp_hashes_filepath: path to the HIBP file
         ad_user_hashes: imported AD user NTLM hashes. Output from import_users
         finding_type: type of finding
         obfuscated: flag to determine whether the hash should be obfuscated
+        sorted_lookup: try a binary search lookup before falling back to a full scan of the file
+        workers: number of worker processes used to scan the file
+        block_size: size in MB of the blocks the file is split into for scanning
+        engine: engine used to scan blocks, one of SCAN_ENGINES
+        encoding: encoding of the file. Detected from the start of the file if not given
+        cache: result cache for the file. Only hashes that are not in the cache are searched for, and their
+            verdicts are added to it
+        metrics: stage metrics to record the blocks and bytes scanned, and the time each worker was busy, in
+        pool: worker pool shared with the other checks of the audit. A pool is started for the search if not given
     Returns:
         List of users matching the given password dictionary file (HIBP or custom)
     """
 
-    result = mp.Manager().list()
     hash_client = Hashing()
+    hibp_hashes_filepath = _sanitize_filepath(hibp_hashes_filepath)
 
-    if isinstance(log_handler, StdoutLogger):
-        worker_args = [
-            ad_user_hashes,
-            result,
-            finding_type,
-            log_handler,
-            obfuscated,
-            hash_client
-        ]
-    else:
-        worker_args = [
-            ad_user_hashes,
-            result,
-            finding_type,
-            None,
-            obfuscated,
-            hash_client
-        ]
-
-    _multi_pro_search(
+    search_hashes = ad_user_hashes
+    cached_verdicts = {}
+    if cache is not None:
+        cached_verdicts, uncached_hashes = cache.partition(ad_user_hashes)
+        search_hashes = {ntlm_hash: ad_user_hashes[ntlm_hash] for ntlm_hash in uncached_hashes}
+        log_handler.log('DEBUG', f'{len(cached_verdicts)} hashes found in the result cache,'
+                                 f' searching for {len(search_hashes)} new hashes')
+        if metrics is not None:
+            metrics.counters['cached_hashes'] = len(cached_verdicts)
+
+    results = []
+    if search_hashes:
+        results = _search_file(
+            log_handler=log_handler,
+            hibp_hashes_filepath=hibp_hashes_filepath,
+            ad_user_hashes=search_hashes,
+            finding_type=finding_type,
+            obfuscated=obfuscated,
+            hash_client=hash_client,
+            sorted_lookup=sorted_lookup,
+            workers=workers,
+            block_size=block_size,
+            engine=engine,
+            encoding=encoding,
+            metrics=metrics,
+            pool=pool)
+
+    if cache is not None:
+        # Map the hash in each finding back to the NTLM hash, in case it has been obfuscated
+        finding_hashes = {hash_client.obfuscate(h) if obfuscated else h: h for h in search_hashes}
+        verdicts = dict.fromkeys(search_hashes)
+        for finding in results:
+            verdicts[finding_hashes[finding.get('hash')]] = finding.get('matches_in_hibp')
+        cache.update(verdicts)
+        cache.save()
+
+        logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+        for ntlm_hash, count in cached_verdicts.items():
+            if count is not None:
+                _record_match(ntlm_hash, count, 'REDACTED', ad_user_hashes, results, finding_type, logger,
+                              obfuscated, hash_client)
+
+    return results
+
+
+def _search_file(log_handler: JSONLogger or StdoutLogger,
+                 hibp_hashes_filepath: str,
+                 ad_user_hashes: Dict[str, List[str]],
+                 finding_type: str,
+                 obfuscated: bool,
+                 hash_client: Hashing,
+                 sorted_lookup: bool,
+                 workers: int,
+                 block_size: int,
+                 engine: str,
+                 encoding: Optional[str],
+                 metrics: StageMetrics = None,
+                 pool: WorkerPool = None) -> List[dict]:
+    """ Search for AD users in the HIBP file with the lookup or engine that suits the file. Arguments are as for
+    search, with the addition of the Hashing instance used to obfuscate matches
+    """
+
+    if hibp_index.is_index(hibp_hashes_filepath):
+        if metrics is not None:
+            metrics.counters['lookups'] = len(ad_user_hashes)
+        with hibp_index.HIBPIndex(hibp_hashes_filepath) as index:
+            return search_index(
+                log_handler=log_handler,
+                index=index,
+                ad_user_hashes=ad_user_hashes,
+                finding_type=finding_type,
+                obfuscated=obfuscated,
+                hash_client=hash_client)
+
+    # Worker processes only return their findings, which are output by this process
+    worker_args = [
+        ad_user_hashes,
+        finding_type,
+        None,
+        obfuscated,
+        hash_client
+    ]
+
+    compression_format = compression.compression_format(hibp_hashes_filepath)
+    if compression_format:
+        log_handler.log('DEBUG', f'File is {compression_format} compressed, decompressing it as it is scanned')
+    elif sorted_lookup:
+        if _file_is_sorted(hibp_hashes_filepath):
+            if metrics is not None:
+                metrics.counters['lookups'] = len(ad_user_hashes)
+            if engine == 'merge':
+                return _output_findings(log_handler, finding_type, _merge_join_search(
+                    log_handler=log_handler,
+                    hibp_filepath=hibp_hashes_filepath,
+                    ad_user_hashes=ad_user_hashes,
+                    workers=workers,
+                    worker_function_args=worker_args,
+                    metrics=metrics,
+                    pool=pool))
+            return _sorted_search(
+                log_handler=log_handler,
+                hibp_filepath=hibp_hashes_filepath,
+                ad_user_hashes=ad_user_hashes,
+                finding_type=finding_type,
+                obfuscated=obfuscated,
+                hash_client=hash_client)
+        log_handler.log('DEBUG', 'File is not ordered by hash, falling back to a full scan')
+
+    return _output_findings(log_handler, finding_type, _multi_pro_search(
         log_handler=log_handler,
         hibp_filepath=hibp_hashes_filepath,
-        block_size=100,
-        cores=mp.cpu_count(),
+        block_size=block_size,
+        workers=workers,
         worker_function=_worker,
-        worker_function_args=worker_args)
+        worker_function_args=worker_args,
+        engine=engine,
+        ad_user_hashes=ad_user_hashes,
+        encoding=encoding,
+        metrics=metrics,
+        pool=pool))
+
+
+def _output_findings(log_handler: JSONLogger or StdoutLogger,
+                     finding_type: str,
+                     findings: Iterable[dict]) -> List[dict]:
+    """ Collect the findings returned by worker processes. With stdout output, each finding is output as it is
+    returned, so output from different workers is written by one process rather than interleaving
+
+    Args:
+        log_handler: logger instance for outputting
+        finding_type: type of finding
+        findings: findings returned by the worker processes
+    Returns:
+        List of the findings
+    """
+
+    results = []
+    for finding in findings:
+        if isinstance(log_handler, StdoutLogger):
+            log_handler.log('NOTIFY', finding, notify_type=finding_type)
+        results.append(finding)
+    return results
+
+
+def _line_bounds(mm: mmap.mmap, position: int, data_start: int) -> Tuple[int, int]:
+    """ Find the start and end offsets of the line containing the given position
+
+    Args:
+        mm: memory-mapped hash file
+        position: byte offset within the file
+        data_start: offset of the first line, after any byte order mark
+    Returns:
+        Tuple of the offset of the first byte of the line and the offset of its line break
+    """
+
+    line_start = max(mm.rfind(b'\n', data_start, position) + 1, data_start)
+    line_end = mm.find(b'\n', line_start)
+    if line_end == -1:
+        line_end = len(mm)
+    return line_start, line_end
+
+
+def _is_sorted(mm: mmap.mmap, data_start: int, samples: int = SORT_CHECK_SAMPLES) -> bool:
+    """ Check whether a memory-mapped hash file is ordered by hash. Small files are checked in full, larger
+    files are checked by comparing lines sampled at evenly spaced offsets along with the line following each one
+
+    Args:
+        mm: memory-mapped hash file
+        data_start: offset of the first line, after any byte order mark
+        samples: number of offsets to sample in large files
+    Returns:
+        True if the file appears to be ordered by hash
+    """
+
+    file_end = len(mm)
+    if file_end - data_start <= samples * 64:
+        lines = mm[data_start:].splitlines()
+    else:
+        lines = []
+        for position in range(data_start, file_end, (file_end - data_start) // samples):
+            line_start, line_end = _line_bounds(mm, position, data_start)
+            next_start, next_end = _line_bounds(mm, line_end + 1, data_start)
+            lines.append(mm[line_start:line_end])
+            lines.append(mm[next_start:next_end])
+
+    previous_hash = b''
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            continue
+        if not HASH_LINE_PATTERN.match(line):
+            return False
+        line_hash = line[:NTLM_HASH_LENGTH].upper()
+        if line_hash < previous_hash:
+            return False
+        previous_hash = line_hash
+    return previous_hash != b''
+
+
+def _data_start(mm: mmap.mmap) -> int:
+    """ Find the offset of the first line of a memory-mapped hash file, after any UTF-8 byte order mark
+
+    Args:
+        mm: memory-mapped hash file
+    Returns:
+        Offset of the first line
+    """
+
+    return len(codecs.BOM_UTF8) if mm[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+
+
+def _file_is_sorted(filepath: str) -> bool:
+    """ Check whether a hash file is ordered by hash, such as the HIBP "ordered by hash" download
+
+    Args:
+        filepath: path to the hash file
+    Returns:
+        True if the file appears to be ordered by hash
+    """
+
+    if os.path.getsize(filepath) == 0:
+        return False
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _is_sorted(mm, _data_start(mm))
+
+
+def _lower_bound(mm: mmap.mmap, ntlm_hash: bytes, data_start: int, low: int = None) -> int:
+    """ Binary search a memory-mapped file that is ordered by hash for the first line whose hash is not less than
+    the given hash
+
+    Args:
+        mm: memory-mapped hash file
+        ntlm_hash: uppercase NTLM hash to find
+        data_start: offset of the first line, after any byte order mark
+        low: offset of a line start to begin searching from. Defaults to the first line
+    Returns:
+        Offset of the start of the line, or the length of the file if every hash is less than the given hash
+    """
+
+    low, high = data_start if low is None else low, len(mm)
+    while low < high:
+        line_start, line_end = _line_bounds(mm, (low + high) // 2, data_start)
+        if mm[line_start:line_start + NTLM_HASH_LENGTH].upper() < ntlm_hash:
+            low = line_end + 1
+        else:
+            high = line_start
+    return min(low, len(mm))
+
+
+def _binary_search(mm: mmap.mmap, ntlm_hash: bytes, data_start: int) -> Optional[bytes]:
+    """ Binary search a memory-mapped file that is ordered by hash for the given hash
+
+    Args:
+        mm: memory-mapped hash file
+        ntlm_hash: uppercase NTLM hash to find
+        data_start: offset of the first line, after any byte order mark
+    Returns:
+        The matching line, or None if the hash is not in the file
+    """
+
+    low = _lower_bound(mm, ntlm_hash, data_start)
+    if low < len(mm):
+        line_start, line_end = _line_bounds(mm, low, data_start)
+        line = mm[line_start:line_end].rstrip()
+        if line[:NTLM_HASH_LENGTH].upper() == ntlm_hash and line[NTLM_HASH_LENGTH:NTLM_HASH_LENGTH + 1] == b':':
+            return line
+    return None
+
+
+def _sorted_search(log_handler: JSONLogger or StdoutLogger,
+                   hibp_filepath: str,
+                   ad_user_hashes: Dict[str, List[str]],
+                   finding_type: str,
+                   obfuscated: bool,
+                   hash_client: Hashing) -> List[dict]:
+    """ Look up each distinct AD hash in a hash file that is ordered by hash, such as the HIBP "ordered by hash"
+    download, using a binary search of the memory-mapped file
+
+    Args:
+        log_handler: logger instance for outputting
+        hibp_filepath: path to the HIBP file
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        finding_type: type of finding
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_client: Hashing instance used to obfuscate matches
+    Returns:
+        List of users matching the hash file
+    """
+
+    logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+    results = []
+    with open(hibp_filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data_start = _data_start(mm)
+        log_handler.log('DEBUG', f'File is ordered by hash, looking up {len(ad_user_hashes)} hashes')
+        for ntlm_hash in sorted(ad_user_hashes):
+            line = _binary_search(mm, ntlm_hash.encode('utf-8'), data_start)
+            if line is not None:
+                results += _worker(line.decode('utf-8'), ad_user_hashes, finding_type, logger, obfuscated, hash_client)
+
+    return results
+
+
+def _merge_join_search(log_handler: JSONLogger or StdoutLogger,
+                       hibp_filepath: str,
+                       ad_user_hashes: Dict[str, List[str]],
+                       workers: int,
+                       worker_function_args: List,
+                       metrics: StageMetrics = None,
+                       pool: WorkerPool = None) -> Iterator[dict]:
+    """ Merge join a hash file that is ordered by hash against the sorted AD hashes.
+
+    The sorted AD hashes are split into hash range partitions containing equal numbers of hashes, and each partition
+    is handled by a worker process. A worker binary searches to the first hash in its range, reads forward through
+    the file alongside its AD hashes, and stops as soon as it passes the last one. Long runs of lines between two AD
+    hashes are skipped with a binary search, so workers do not read data that cannot contain a match.
+
+    Args:
+        log_handler: logger instance for outputting
+        hibp_filepath: path to the HIBP file
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        workers: number of worker processes
+        worker_function_args: arguments for the worker function
+        metrics: stage metrics to record the partitions and the time each worker was busy in
+        pool: worker pool shared with the other checks of the audit. A pool is started if not given
+    Returns:
+        Generator of users matching the hash file
+    """
+
+    sorted_hashes = sorted(ntlm_hash.encode('utf-8') for ntlm_hash in ad_user_hashes)
+    partition_count = min(len(sorted_hashes), workers * 4)
+    partitions = [(len(sorted_hashes) * i // partition_count, len(sorted_hashes) * (i + 1) // partition_count)
+                  for i in range(partition_count)]
+    workers = pool.processes if pool is not None else max(min(workers, partition_count), 1)
+
+    log_handler.log('DEBUG', f'File is ordered by hash, merge joining {len(sorted_hashes)} hashes'
+                             f' in {partition_count} hash ranges')
+    log_handler.log('DEBUG', f'{workers} worker processes being utilised')
+
+    if not partitions:
+        return
+    initargs = (hibp_filepath, _worker, 'utf-8', worker_function_args, None, None, sorted_hashes,
+                _merge_join_partition)
+    for _, worker, busy_seconds, partition_results in _run_jobs(initargs, workers, partitions, pool=pool):
+        if metrics is not None:
+            metrics.blocks += 1
+            metrics.add_worker_time(worker, busy_seconds)
+        yield from partition_results
+
+
+def _merge_join_partition(partition: Tuple[int, int]) -> List[dict]:
+    """ Merge join one hash range partition of the sorted AD hashes against the memory-mapped hash file
+
+    Args:
+        partition: start and end indexes of the partition in the sorted AD hashes
+    Returns:
+        List of the findings in the partition
+    """
+
+    start, end = partition
+    hashes = _worker_state['sorted_hashes'][start:end]
+    function = _worker_state['function']
+    func_args = _worker_state['func_args']
+    partition_results = []
+
+    with open(_worker_state['filepath'], 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data_start = _data_start(mm)
+        file_end = len(mm)
+        position = _lower_bound(mm, hashes[0], data_start)
+        last_hash = hashes[-1]
+        index = 0
+        skipped = 0
+
+        while position < file_end:
+            line_end = mm.find(b'\n', position)
+            if line_end == -1:
+                line_end = file_end
+            line_hash = mm[position:position + NTLM_HASH_LENGTH].upper()
+            if line_hash > last_hash:
+                break
+
+            while hashes[index] < line_hash:
+                index += 1
+            if hashes[index] == line_hash:
+                output = function(mm[position:line_end].decode('utf-8'), *func_args)
+                if output:
+                    partition_results.extend(output)
+                skipped = 0
+            else:
+                skipped += 1
+                if skipped >= MERGE_GALLOP_LINES:
+                    skipped = 0
+                    position = _lower_bound(mm, hashes[index], data_start, low=line_end + 1)
+                    continue
+            position = line_end + 1
+
+    return partition_results
+
+
+def search_index(log_handler: JSONLogger or StdoutLogger,
+                 index: hibp_index.HIBPIndex or 'SortedHashFile',
+                 ad_user_hashes: Dict[str, List[str]],
+                 finding_type: str,
+                 obfuscated: bool,
+                 hash_client: Hashing = None) -> List[dict]:
+    """ Look up each distinct AD hash in an open HIBP index, either a binary index created with
+    `lil-pwny index build` or a text file ordered by hash
+
+    Args:
+        log_handler: logger instance for outputting
+        index: open HIBPIndex or SortedHashFile
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        finding_type: type of finding
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_client: Hashing instance used to obfuscate matches
+    Returns:
+        List of users matching the index
+    """
+
+    hash_client = hash_client or Hashing()
+    logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+    results = []
+    log_handler.log('DEBUG', f'Looking up {len(ad_user_hashes)} hashes in HIBP index {index.filepath}')
+    for ntlm_hash in sorted(ad_user_hashes):
+        count = index.lookup(ntlm_hash)
+        if count is not None:
+            _record_match(ntlm_hash, str(count), 'REDACTED', ad_user_hashes, results, finding_type, logger,
+                          obfuscated, hash_client)
+
+    return results
+
+
+def search_passwords(log_handler: JSONLogger or StdoutLogger,
+                     passwords: Iterable[str],
+                     ad_user_hashes: Dict[str, List[str]],
+                     finding_type: str,
+                     obfuscated: bool,
+                     hash_engine: HashingEngine) -> List[dict]:
+    """ Hash plaintext candidate passwords and check them against the AD user hashes in memory.
+
+    Candidates are hashed in batches by the hashing engine's worker processes, and the raw digests are checked
+    against the AD hashes as each batch completes. Batches are read from the candidates as workers become free, so
+    a generator of candidates is never held in memory in full.
+
+    Args:
+        log_handler: logger instance for outputting
+        passwords: plaintext candidate passwords, e.g. custom passwords or their variants
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        finding_type: type of finding
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_engine: engine used to hash the candidates
+    Returns:
+        List of users whose password is one of the candidates
+    """
+
+    hash_client = Hashing()
+    logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+    results = []
+
+    hash_count, hash_time = hash_engine.hash_count, hash_engine.hash_time
+    for ntlm_hash, plaintext_password in _hash_and_match(hash_engine, passwords, _ad_digests(ad_user_hashes)):
+        _record_match(ntlm_hash, '0', plaintext_password, ad_user_hashes, results, finding_type, logger, obfuscated,
+                      hash_client)
 
-    return result._getvalue()
+    _log_hash_rate(log_handler, hash_engine.hash_count - hash_count, hash_engine.hash_time - hash_time)
+    return results
 
 
-def _nonblank_lines(f: TextIO) -> str:
-    """ Generator to filter out blank lines from the input list
+def search_custom_variants(log_handler: JSONLogger or StdoutLogger,
+                           custom_passwords: List[str],
+                           variant_generator: CustomVariantGenerator,
+                           ad_user_hashes: Dict[str, List[str]],
+                           finding_type: str,
+                           obfuscated: bool,
+                           hash_engine: HashingEngine,
+                           variant_cache: VariantHashCache = None) -> Tuple[List[dict], int]:
+    """ Generate the enhanced variants of each custom password and check them against the AD user hashes.
+
+    If a variant cache is given, custom passwords whose variants are in the cache are checked against the cached
+    digests, and only the variants that match are generated again to find their plaintext. The variants of other
+    custom passwords are generated and hashed, then added to the cache.
+
+    Args:
+        log_handler: logger instance for outputting
+        custom_passwords: plaintext custom passwords to enhance
+        variant_generator: generator for the variants of each custom password
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        finding_type: type of finding
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_engine: engine used to hash the variants
+        variant_cache: cache of the digests of the variants of each custom password
+    Returns:
+        List of users whose password is a variant of a custom password, and the number of variants checked
+    """
+
+    hash_client = Hashing()
+    logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+    results = []
+    variants_count = 0
+    # Shared by every custom password, so an AD hash matched by variants of two custom passwords is recorded once
+    ad_digests = _ad_digests(ad_user_hashes)
+
+    hash_count, hash_time = hash_engine.hash_count, hash_engine.hash_time
+    for custom_pwd in dict.fromkeys(custom_passwords):
+        cached_matches = None
+        if variant_cache is not None:
+            cached_matches = variant_cache.lookup(custom_pwd, ad_digests)
+
+        if cached_matches is not None:
+            password_variants = variant_cache.variant_count(custom_pwd)
+            log_handler.log('DEBUG', f'Checking {password_variants} cached variants of `{custom_pwd}`')
+            plaintext_passwords = _regenerate_variants(variant_generator, custom_pwd, cached_matches)
+            matches = [(ad_digests.pop(digest), plaintext_passwords[digest]) for digest in cached_matches]
+        else:
+            log_handler.log('DEBUG', f'Generating variants for `{custom_pwd}`...')
+            variant_digests = [] if variant_cache is not None else None
+            variants = (variant for chunk in variant_generator.generate_variants(custom_pwd) for variant in chunk)
+            password_hash_count = hash_engine.hash_count
+            matches = list(_hash_and_match(hash_engine, variants, ad_digests, variant_digests))
+            password_variants = hash_engine.hash_count - password_hash_count
+            if variant_digests is not None:
+                variant_cache.store(custom_pwd, b''.join(variant_digests))
+            log_handler.log('SUCCESS', f'Generated {password_variants} variants for `{custom_pwd}`')
+
+        variants_count += password_variants
+        for ntlm_hash, plaintext_password in matches:
+            _record_match(ntlm_hash, '0', plaintext_password, ad_user_hashes, results, finding_type, logger,
+                          obfuscated, hash_client)
+
+    _log_hash_rate(log_handler, hash_engine.hash_count - hash_count, hash_engine.hash_time - hash_time)
+    return results, variants_count
+
+
+def _hash_and_match(hash_engine: HashingEngine,
+                    passwords: Iterable[str],
+                    ad_digests: Dict[bytes, str],
+                    digests_out: List[bytes] = None) -> Iterator[Tuple[str, str]]:
+    """ Hash plaintext candidate passwords with the hashing engine and yield those that match an AD user hash. Matched
+    digests are removed from ad_digests, so each AD hash is only yielded once even if the same password is generated
+    more than once
+
+    Args:
+        hash_engine: engine used to hash the candidates
+        passwords: plaintext candidate passwords
+        ad_digests: raw digests of the AD user hashes, from _ad_digests
+        digests_out: if given, the concatenated digests of each batch of candidates are appended to it, in order
+    Returns:
+        Generator of (NTLM hash, plaintext password) for each matching candidate
+    """
+
+    candidates = iter(passwords)
+    batches = iter(lambda: list(itertools.islice(candidates, HASH_BATCH_SIZE)), [])
+    for batch, digests in hash_engine.digest_batches(batches):
+        if digests_out is not None:
+            digests_out.append(digests)
+        for password, digest in zip(batch, split_digests(digests)):
+            ntlm_hash = ad_digests.pop(digest, None)
+            if ntlm_hash is not None:
+                yield ntlm_hash, password
+
+
+def _regenerate_variants(variant_generator: CustomVariantGenerator,
+                         custom_password: str,
+                         positions: Dict[bytes, int]) -> Dict[bytes, str]:
+    """ Generate the variants of a custom password again to find the plaintext of the variants at the given positions,
+    without hashing them
+
+    Args:
+        variant_generator: generator for the variants of the custom password
+        custom_password: the custom password
+        positions: dict of digests to the position of their variant, from VariantHashCache.lookup
+    Returns:
+        Dict of digests to the plaintext of their variant
+    """
+
+    if not positions:
+        return {}
+    digests_by_position = {position: digest for digest, position in positions.items()}
+    last_position = max(digests_by_position)
+    plaintext_passwords = {}
+    variants = (variant for chunk in variant_generator.generate_variants(custom_password) for variant in chunk)
+    for position, variant in enumerate(itertools.islice(variants, last_position + 1)):
+        if position in digests_by_position:
+            plaintext_passwords[digests_by_position[position]] = variant
+    return plaintext_passwords
+
+
+def search_usernames(log_handler: JSONLogger or StdoutLogger,
+                     ad_user_hashes: Dict[str, List[str]],
+                     finding_type: str,
+                     obfuscated: bool,
+                     hash_engine: HashingEngine) -> List[dict]:
+    """ Find users whose password is a variation of their own username. Only the variants of each user's username
+    are hashed and compared with that user's NTLM hash.
+
+    Args:
+        log_handler: logger instance for outputting
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
+        finding_type: type of finding
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_engine: engine used to hash the username variants
+    Returns:
+        List of users whose password is a variation of their username
+    """
+
+    hash_client = Hashing()
+    logger = log_handler if isinstance(log_handler, StdoutLogger) else None
+    results = []
+    generator = UsernameVariantGenerator()
+    # The raw digest, hash and username of the user that each variant in a batch belongs to, for the batches that have
+    # been sent to the engine
+    batch_owners = collections.deque()
+
+    def _variant_batches() -> Iterator[List[str]]:
+        batch, owners = [], []
+        for ntlm_hash, usernames in ad_user_hashes.items():
+            try:
+                user_digest = bytes.fromhex(ntlm_hash)
+            except ValueError:
+                continue
+            for username in usernames:
+                for variant in generator.generate_user_variations(username):
+                    batch.append(variant)
+                    owners.append((user_digest, ntlm_hash, username))
+            if len(batch) >= HASH_BATCH_SIZE:
+                batch_owners.append(owners)
+                yield batch
+                batch, owners = [], []
+        if batch:
+            batch_owners.append(owners)
+            yield batch
+
+    hash_count, hash_time = hash_engine.hash_count, hash_engine.hash_time
+    matched_users = set()
+    for batch, digests in hash_engine.digest_batches(_variant_batches()):
+        for variant, digest, (user_digest, ntlm_hash, username) in zip(batch,
+                                                                       split_digests(digests),
+                                                                       batch_owners.popleft()):
+            # The same username can have the same hash in more than one AD user file
+            user_key = (ntlm_hash, username, getattr(username, 'source', None))
+            if digest == user_digest and user_key not in matched_users:
+                matched_users.add(user_key)
+                _record_match(ntlm_hash, '0', variant, ad_user_hashes, results, finding_type, logger,
+                              obfuscated, hash_client, usernames=[username])
+
+    _log_hash_rate(log_handler, hash_engine.hash_count - hash_count, hash_engine.hash_time - hash_time)
+    return results
+
+
+def _ad_digests(ad_user_hashes: Dict[str, List[str]]) -> Dict[bytes, str]:
+    """ Map the raw digest of each AD user hash to the hash, so digests from the hashing engine can be matched without
+    converting them to hex
 
     Args:
-        f: input file
+        ad_user_hashes: imported AD user NTLM hashes. Output from import_users
     Returns:
-        Yields line if it isn't blank
+        Dict of raw digests to NTLM hashes
     """
 
-    for line in f:
-        if line.rstrip():
-            yield line
+    digests = {}
+    for ntlm_hash in ad_user_hashes:
+        try:
+            digests[bytes.fromhex(ntlm_hash)] = ntlm_hash
+        except ValueError:
+            continue
+    return digests
+
+
+def _log_hash_rate(log_handler: JSONLogger or StdoutLogger, hash_count: int, hash_time: float) -> None:
+    """ Log how many passwords were hashed and how fast
+
+    Args:
+        log_handler: logger instance for outputting
+        hash_count: number of passwords hashed
+        hash_time: seconds taken to hash them
+    """
+
+    if not hash_count:
+        return
+    rate = hash_count / hash_time if hash_time else 0
+    log_handler.log('INFO', f'Hashed {hash_count} passwords at {rate:,.0f} hashes per second')
+
+
+class SortedHashFile:
+    """ Memory-mapped text hash file ordered by hash, kept open for repeated binary search lookups
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = _sanitize_filepath(filepath)
+        if not _file_is_sorted(self.filepath):
+            raise ValueError(f'File is not ordered by hash: {filepath}')
+        self._file = open(self.filepath, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data_start = _data_start(self._mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def lookup(self, ntlm_hash: str) -> Optional[int]:
+        """ Look up an NTLM hash in the file
+
+        Args:
+            ntlm_hash: NTLM hash as a hex string
+        Returns:
+            Number of occurrences of the hash in HIBP, or None if it is not in the file
+        """
+
+        line = _binary_search(self._mm, ntlm_hash.upper().encode('utf-8'), self._data_start)
+        if line is None:
+            return None
+        try:
+            return int(line.split(b':')[1])
+        except (IndexError, ValueError):
+            raise MalformedHIBPError(line.decode('utf-8', errors='replace'))
 
 
 def _divide_blocks(filepath: str,
@@ -181,103 +987,378 @@ def _divide_blocks(filepath: str,
     return blocks
 
 
-def _parallel_process_block(block_data: str) -> List[dict]:
-    """ Carry out worker function on each line in a block
+def _init_worker(filepath: str,
+                 function: callable,
+                 encoding: str,
+                 func_args: List,
+                 match_keys=None,
+                 prefix_filter: frozenset = None,
+                 sorted_hashes: List[bytes] = None,
+                 job_function: callable = None) -> None:
+    """ Pool initializer that stores the state shared by every block in the worker process, so it is sent to each
+    worker once rather than with every job
+
+    Args:
+        filepath: Path for the hash file (HIBP or custom)
+        function: worker function to run on each line
+        encoding: encoding of the hash file
+        func_args: arguments for the worker function, including the AD user hashes
+        match_keys: sorted NumPy array of AD hash keys, used by the numpy engine
+        prefix_filter: prefixes of the AD hashes, used by the python engine to skip lines before parsing them
+        sorted_hashes: sorted AD hashes, used by the merge join
+        job_function: function that processes each job, such as a block of the file
+    """
+
+    _worker_state.update(filepath=filepath, function=function, encoding=encoding, func_args=func_args,
+                         match_keys=match_keys, prefix_filter=prefix_filter, sorted_hashes=sorted_hashes,
+                         job_function=job_function)
+
+
+def _timed_job(job: Tuple[int, int or bytes]) -> Tuple[int, int, float, Any]:
+    """ Run the job function of the worker process on a job, timing how long the worker is busy with it
 
     Args:
-        block_data: information on the block to process, start - end etc.
+        job: job to process, such as the offset and length of a block
     Returns:
-        List containing results of the worker on the block
+        The first element of the job, such as the offset of the block, process ID of the worker, seconds it spent on
+        the job, and the result of the job function, such as the findings of the job
     """
 
-    block_start, block_size, filepath, function, encoding = block_data[:5]
-    func_args = block_data[5:]
-    block_results = []
+    start = time.perf_counter()
+    job_results = _worker_state['job_function'](job)
+    return job[0], os.getpid(), time.perf_counter() - start, job_results
 
-    # Open the file again with the detected encoding and process the block
-    with open(filepath, 'rb') as f:
+
+def _imap_bounded(pool: Pool, function: callable, jobs: Iterable, window: int) -> Iterator:
+    """ Like Pool.imap_unordered, but only takes a job from the iterable when fewer than `window` are in flight.
+    Pool.imap_unordered reads the whole iterable up front, which would hold every chunk of a compressed file in memory
+
+    Args:
+        pool: pool to run the jobs in
+        function: function to run on each job
+        jobs: iterable of jobs
+        window: maximum number of jobs in flight
+    Returns:
+        Generator of the results of the jobs, in the order they complete
+    """
+
+    completed = queue.Queue()
+    in_flight = 0
+    jobs = iter(jobs)
+    while True:
+        for job in itertools.islice(jobs, window - in_flight):
+            pool.apply_async(function, (job,), callback=completed.put, error_callback=completed.put)
+            in_flight += 1
+        if not in_flight:
+            return
+        result = completed.get()
+        in_flight -= 1
+        if isinstance(result, BaseException):
+            raise result
+        yield result
+
+
+def _run_jobs(initargs: tuple,
+              workers: int,
+              jobs: Iterable,
+              bounded: bool = False,
+              pool: WorkerPool = None) -> Iterator[Tuple[int, int, float, List[dict]]]:
+    """ Run jobs with _timed_job in worker processes that have been initialized with _init_worker
+
+    Args:
+        initargs: arguments for _init_worker
+        workers: number of worker processes to start if no pool is given
+        jobs: iterable of jobs
+        bounded: only read a few jobs per worker from the iterable at a time, rather than reading it all up front
+        pool: worker pool shared with the other checks of the audit. The worker state is installed in its workers,
+            and jobs are always fed a few at a time so jobs of the other checks are not queued behind all of them
+    Returns:
+        Generator of the results of _timed_job, in the order the jobs complete
+    """
+
+    if pool is not None:
+        pool.install(_init_worker, *initargs)
+        yield from _imap_bounded(pool.pool, _timed_job, jobs, pool.processes * 2)
+        return
+
+    with mp.Pool(workers, initializer=_init_worker, initargs=initargs) as own_pool:
+        if bounded:
+            yield from _imap_bounded(own_pool, _timed_job, jobs, workers * 2)
+        else:
+            yield from own_pool.imap_unordered(_timed_job, jobs)
+
+
+def _build_prefix_filter(ntlm_hashes: Iterable[str], as_bytes: bool = True) -> frozenset:
+    """ Build a set of the leading characters of each hash, in every combination of upper and lower case, so lines
+    can be rejected by checking their first few characters before they are parsed
+
+    Args:
+        ntlm_hashes: NTLM hashes as hex strings
+        as_bytes: build the prefixes as bytes to check raw lines, rather than as strings
+    Returns:
+        Set of hash prefixes
+    """
+
+    prefixes = set()
+    for ntlm_hash in ntlm_hashes:
+        variants = ['']
+        for char in ntlm_hash[:PREFIX_FILTER_LENGTH]:
+            variants = [variant + case for variant in variants for case in {char.upper(), char.lower()}]
+        prefixes.update(variants)
+    if as_bytes:
+        return frozenset(prefix.encode('ascii', errors='replace') for prefix in prefixes)
+    return frozenset(prefixes)
+
+
+def _resolve_engine(engine: str, encoding: str) -> str:
+    """ Choose the engine used to scan blocks of the hash file
+
+    Args:
+        engine: requested engine, one of SCAN_ENGINES
+        encoding: encoding of the hash file
+    Returns:
+        'numpy' if the requested engine can be used with the file, otherwise 'python'
+    """
+
+    if engine not in SCAN_ENGINES:
+        raise ValueError(f'Unknown scan engine: {engine}')
+    if engine == 'numpy' and not numpy_matcher.is_available():
+        raise ValueError('The numpy engine requires NumPy. Install it with `pip install lil-pwny[numpy]`')
+    # The merge join only applies to files ordered by hash, other files are scanned as with auto
+    if engine == 'python' or not numpy_matcher.is_available():
+        return 'python'
+    # The vectorised matcher reads hashes directly from the raw bytes, so they must be ASCII
+    if not is_ascii_compatible(encoding):
+        return 'python'
+    return 'numpy'
+
+
+def _read_block(block_data: Tuple[int, int or bytes]) -> bytes:
+    """ Read a block of the hash file in a worker process
+
+    Args:
+        block_data: offset and length of the block, or offset and content of a chunk of a compressed file
+    Returns:
+        Content of the block
+    """
+
+    block_start, block = block_data
+    if isinstance(block, bytes):
+        return block
+    with open(_worker_state['filepath'], 'rb') as f:
         f.seek(block_start)
-        cont = f.read(block_size).decode(encoding=encoding)
-        lines = cont.splitlines()
+        return f.read(block)
+
+
+def _count_lines(block: bytes) -> int:
+    """ Count the lines in a block of an ASCII compatible file. Newlines are counted in C, without splitting the block
+
+    Args:
+        block: raw bytes of the block
+    Returns:
+        Number of lines, including a last line without a line break
+    """
+
+    return block.count(b'\n') + (1 if block and not block.endswith(b'\n') else 0)
+
+
+def _check_block_format(first_line: Optional[bytes]) -> None:
+    """ Check that the first line of a block is in the "hash:occurrences" format. Lines rejected by the prefix filter
+    are never parsed, so without this a file in another format, such as SHA-1 hashes, would be scanned without error
+
+    Args:
+        first_line: first non-blank line of the block, or None if the block is blank
+    """
+
+    if first_line is not None and not HASH_LINE_PATTERN.match(first_line):
+        raise MalformedHIBPError(first_line.decode('utf-8', errors='replace'))
+
+
+def _parallel_process_block(block_data: Tuple[int, int or bytes]) -> Tuple[List[dict], int]:
+    """ Carry out worker function on each line in a block. If a prefix filter is set, lines whose hash prefix does
+    not belong to any AD user are skipped without being decoded or parsed. The first line of the block and every line
+    that passes the filter are checked to be in the "hash:occurrences" format
 
-        for i, line in enumerate(lines):
-            output = function(line, *func_args)
-            if output is not None:
-                block_results.append(output)
+    Args:
+        block_data: offset and length of the block to process, or offset and content of a chunk of a compressed file
+    Returns:
+        List of the findings in the block, and the number of lines in the block
+    """
 
-    return block_results
+    block_start = block_data[0]
+    function = _worker_state['function']
+    func_args = _worker_state['func_args']
+    encoding = _worker_state['encoding']
+    prefix_filter = _worker_state.get('prefix_filter')
+    block_results = []
+
+    cont = _read_block(block_data)
+
+    if prefix_filter is not None and is_ascii_compatible(encoding):
+        if block_start == 0 and cont.startswith(codecs.BOM_UTF8):
+            cont = cont[len(codecs.BOM_UTF8):]
+        _check_block_format(FIRST_LINE_PATTERN.match(cont).group(1))
+        line_count = _count_lines(cont)
+        lines = (line.decode(encoding) for line in cont.split(b'\n')
+                 if line[:PREFIX_FILTER_LENGTH] in prefix_filter)
+    else:
+        lines = cont.decode(encoding=encoding).splitlines()
+        line_count = len(lines)
+        if prefix_filter is not None:
+            first_line = next((line for line in lines if line.strip()), None)
+            _check_block_format(first_line.strip().encode('utf-8', errors='replace') if first_line else None)
+            lines = (line for line in lines if line[:PREFIX_FILTER_LENGTH] in prefix_filter)
+
+    for line in lines:
+        # A truncated line can pass the prefix filter, then fail to match without an error
+        if prefix_filter is not None and not HASH_TEXT_PATTERN.match(line):
+            raise MalformedHIBPError(line.strip())
+        output = function(line, *func_args)
+        if output:
+            block_results.extend(output)
+
+    return block_results, line_count
+
+
+def _numpy_process_block(block_data: Tuple[int, int or bytes]) -> Tuple[List[dict], int]:
+    """ Find candidate lines in a block with vectorised NumPy operations, then carry out the worker function on
+    only those lines
+
+    Args:
+        block_data: offset and length of the block to process, or offset and content of a chunk of a compressed file
+    Returns:
+        List of the findings in the block, and the number of lines in the block
+    """
+
+    block_start = block_data[0]
+    function = _worker_state['function']
+    func_args = _worker_state['func_args']
+    encoding = _worker_state['encoding']
+    block_results = []
+
+    block = _read_block(block_data)
+    if block_start == 0 and block.startswith(codecs.BOM_UTF8):
+        block = block[len(codecs.BOM_UTF8):]
+
+    for line_start, line_end in numpy_matcher.find_candidate_lines(block, _worker_state['match_keys']):
+        output = function(block[line_start:line_end].decode(encoding), *func_args)
+        if output:
+            block_results.extend(output)
+
+    return block_results, _count_lines(block)
 
 
 def _multi_pro_search(log_handler: JSONLogger or StdoutLogger,
                       hibp_filepath: str,
                       block_size: int,
-                      cores: int,
+                      workers: int,
                       worker_function: callable,
                       worker_function_args: List,
-                      skip_lines: int = 0) -> List[dict]:
+                      skip_lines: int = 0,
+                      engine: str = 'python',
+                      ad_user_hashes: Dict[str, List[str]] = None,
+                      encoding: str = None,
+                      metrics: StageMetrics = None,
+                      pool: WorkerPool = None) -> Iterator[dict]:
     """ Breaks the [HIBP|custom passwords] file into blocks and uses multiprocessing to iterate through them and return
-     any matches against AD users.
+     any matches against AD users. The worker function and its arguments are sent to each process once when the pool
+     starts, so each job only carries the offset and length of its block. Blocks are handed out as workers become
+     free, and findings are yielded as soon as the block they are in completes. Progress is reported as each block
+     completes.
+
+     Compressed files (gzip, xz or bz2) cannot be seeked into, so they are decompressed by this process as they are
+     read, and each line aligned chunk is sent to the next free worker. Decompression overlaps with matching, and
+     only a few chunks per worker are held in memory at once.
 
     Args:
         log_handler: logger instance for outputting
         block_size: size of 1 block in MB
-        cores: number of processes
+        workers: number of worker processes
         skip_lines: number of top lines to skip while processing
         worker_function: worker function that will carry out processing
         worker_function_args: arguments for the worker function
+        engine: engine used to scan blocks, one of SCAN_ENGINES
+        ad_user_hashes: imported AD user NTLM hashes, used to skip lines that cannot match
+        encoding: encoding of the file. Detected from the start of the file if not given
+        metrics: stage metrics to record the blocks and bytes scanned, and the time each worker was busy, in
+        pool: worker pool shared with the other checks of the audit. A pool is started for the search if not given
     Returns:
-        List of users matching the given password dictionary file (HIBP or custom)
+        Generator of users matching the given password dictionary file (HIBP or custom)
     """
 
     hibp_filepath = _sanitize_filepath(hibp_filepath)
+    encoding = encoding or detect_encoding(hibp_filepath)
+    file_end = os.path.getsize(hibp_filepath)
 
-    # Detect the file encoding
-    with open(hibp_filepath, 'rb') as f:
-        raw_data = f.read(10000)  # Read the first 10KB for encoding detection
-        encoding = from_bytes(raw_data).best().encoding
-
-    jobs = _divide_blocks(hibp_filepath, 1024 * 1024 * block_size, skip_lines)
-    jobs = [list(j) + [worker_function, encoding] + worker_function_args for j in jobs]
-
-    log_handler.log('DEBUG', f'Split into {len(jobs)} parallel jobs ')
-    log_handler.log('DEBUG', f'{cores} cores being utilised')
-
-    pool = mp.Pool(cores - 1, maxtasksperchild=1000)
-
-    outputs = []
-    for block_number in range(0, len(jobs), cores - 1):
-        block_results = pool.map(_parallel_process_block, jobs[block_number: block_number + cores - 1])
+    reader = None
+    if compression.compression_format(hibp_filepath):
+        chunk_size = min(block_size, COMPRESSED_CHUNK_SIZE)
+        reader = compression.ChunkReader(hibp_filepath, 1024 * 1024 * chunk_size, skip_lines)
+        jobs = reader
+        # Progress of compressed files is measured in compressed bytes, as the decompressed size is not known
+        job_bytes = reader.compressed_bytes
+        progress = ScanProgress(log_handler, file_end)
+        log_handler.log('DEBUG', f'Streaming {reader.format} compressed file in chunks of {chunk_size} MB')
+    else:
+        jobs = [(block_start, length) for block_start, length, _ in
+                _divide_blocks(hibp_filepath, 1024 * 1024 * block_size, skip_lines)]
+        # The last block is allowed to run past the end of the file
+        job_bytes = {block_start: min(length, file_end - block_start) for block_start, length in jobs}
+        workers = max(min(workers, len(jobs)), 1)
+        progress = ScanProgress(log_handler, file_end - jobs[0][0])
+        log_handler.log('DEBUG', f'Split into {len(jobs)} parallel jobs ')
+    if pool is not None:
+        workers = pool.processes
+    log_handler.log('DEBUG', f'{workers} worker processes being utilised')
 
-        for i, sub_list in enumerate(block_results):
-            for x in sub_list:
-                outputs.append(x)
-        del block_results
-        gc.collect()
+    match_keys = None
+    prefix_filter = None
+    block_function = _parallel_process_block
+    if ad_user_hashes is not None:
+        if _resolve_engine(engine, encoding) == 'numpy':
+            match_keys = numpy_matcher.hash_keys(ad_user_hashes)
+            block_function = _numpy_process_block
+        else:
+            prefix_filter = _build_prefix_filter(ad_user_hashes, as_bytes=is_ascii_compatible(encoding))
+    log_handler.log('DEBUG', f'Scanning blocks with the {"numpy" if match_keys is not None else "python"} engine')
 
-    pool.close()
-    pool.terminate()
+    initargs = (hibp_filepath, worker_function, encoding, worker_function_args, match_keys, prefix_filter, None,
+                block_function)
+    completed_jobs = _run_jobs(initargs, workers, jobs, bounded=reader is not None, pool=pool)
+    for block_start, worker, busy_seconds, (block_results, block_lines) in completed_jobs:
+        block_bytes = job_bytes.pop(block_start)
+        if metrics is not None:
+            metrics.blocks += 1
+            metrics.lines += block_lines
+            metrics.add_worker_time(worker, busy_seconds)
+            if reader is None:
+                metrics.bytes += block_bytes
+        progress.update(block_bytes, len(block_results))
+        yield from block_results
+    progress.finish()
+    if metrics is not None and reader is not None:
+        metrics.bytes += reader.decompressed_bytes
+        metrics.counters['compressed_bytes'] = file_end
 
 
 def _worker(line: str,
             user_list: Dict,
-            result: List[dict],
             notify_type: str,
             logger: StdoutLogger or JSONLogger = None,
             obfuscated: bool = False,
-            hash_client: Hashing = None) -> List[dict]:
+            hash_client: Hashing = None) -> Optional[List[dict]]:
     """ Worker function that carries out the processing on a line from the HIBP/custom passwords file. Checks to see
-    whether the hash on that line is in the imported AD users. If a match, a dict containing match data is appended
-    to the list shared between processes via multiprocessing
+    whether the hash on that line is in the imported AD users. If a match, a dict containing match data is returned
+    for each user with that hash
 
     Args:
         line: line from a block of the hash file
         user_list: dict containing imported AD user hashes
-        result: multiprocessing list shared between all processes to collect results
         logger: logger instance for outputting
         notify_type: type of finding
         obfuscated: flag to determine whether the hash should be obfuscated
     Returns:
-        List containing dict data of the matching user
+        List containing dict data of the matching users, or None if there is no match
     """
 
     try:
@@ -293,12 +1374,46 @@ def _worker(line: str,
             logger.log('ERROR', f'Failed to parse line: {line}. Error: {str(e)}')
         raise MalformedHIBPError(line)
 
+    if ntlm_hash not in user_list:
+        return None
+
+    result = []
+    _record_match(ntlm_hash, count, plaintext_password, user_list, result, notify_type, logger, obfuscated,
+                  hash_client)
+    return result
+
+
+def _record_match(ntlm_hash: str,
+                  count: str,
+                  plaintext_password: str,
+                  user_list: Dict,
+                  result: List[dict],
+                  notify_type: str,
+                  logger: StdoutLogger or JSONLogger = None,
+                  obfuscated: bool = False,
+                  hash_client: Hashing = None,
+                  usernames: List[str] = None) -> None:
+    """ If the hash belongs to any AD users, append a finding for each of them to the results
+
+    Args:
+        ntlm_hash: uppercase NTLM hash from the hash file
+        count: number of occurrences of the hash in the hash file
+        plaintext_password: plaintext password for the hash, if known
+        user_list: dict containing imported AD user hashes
+        result: list to collect results
+        notify_type: type of finding
+        logger: logger instance for outputting
+        obfuscated: flag to determine whether the hash should be obfuscated
+        hash_client: Hashing instance used to obfuscate matches
+        usernames: only record findings for these users, instead of every user with the hash
+    """
+
     if user_list.get(ntlm_hash):
         return_hash = ntlm_hash
         if obfuscated:
             return_hash = hash_client.obfuscate(ntlm_hash)
             plaintext_password = 'REDACTED'
-        for u in user_list.get(ntlm_hash):
+        for u in usernames or user_list.get(ntlm_hash):
             finding = {
                 'username': u,
                 'hash': return_hash,
@@ -306,8 +1421,8 @@ def _worker(line: str,
                 'plaintext_password': plaintext_password,
                 'obfuscated': obfuscated
             }
+            if isinstance(u, SourcedUsername):
+                finding['source'] = u.source
             if isinstance(logger, StdoutLogger):
                 logger.log('NOTIFY', finding, notify_type=notify_type)
             result.append(finding)
-
-    return result
@@ -0,0 +1,99 @@
+import sys
+import time
+from datetime import timedelta
+from typing import TextIO
+
+from lil_pwny.loggers import JSONLogger, StdoutLogger
+
+# Seconds between progress records in JSON output
+PROGRESS_INTERVAL = 10
+# Seconds between redraws of the status line in stdout output
+STATUS_INTERVAL = 0.5
+
+
+class ScanProgress:
+    """ Reports the progress of a scan of a hash file as each block completes.
+
+    With JSON output, a PROGRESS record is logged every PROGRESS_INTERVAL seconds and when the scan completes. With
+    stdout output, a single status line is redrawn on stderr, if it is a terminal, so it does not mix with findings.
+    """
+
+    def __init__(self,
+                 log_handler: JSONLogger or StdoutLogger,
+                 total_bytes: int,
+                 stream: TextIO = None):
+        self.log_handler = log_handler
+        self.total_bytes = total_bytes
+        self.bytes_done = 0
+        self.blocks_done = 0
+        self.matches = 0
+        self.stream = stream or sys.stderr
+        self.status_line = isinstance(log_handler, StdoutLogger)
+        self.interval = STATUS_INTERVAL if self.status_line else PROGRESS_INTERVAL
+        self._start = time.perf_counter()
+        self._last_report = self._start
+        self._last_bytes = 0
+        self._line_width = 0
+
+    def update(self, block_bytes: int, block_matches: int) -> None:
+        """ Record a completed block, and report progress if the reporting interval has passed
+
+        Args:
+            block_bytes: number of bytes in the block
+            block_matches: number of findings in the block
+        """
+
+        self.bytes_done += block_bytes
+        self.blocks_done += 1
+        self.matches += block_matches
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._report(now)
+
+    def finish(self) -> None:
+        """ Report the final progress of the scan, and end the status line
+        """
+
+        self._report(time.perf_counter(), final=True)
+        if self.status_line and self._line_width:
+            self.stream.write('\n')
+            self.stream.flush()
+
+    def _report(self, now: float, final: bool = False) -> None:
+        elapsed = now - self._start
+        interval = now - self._last_report
+        average_rate = self.bytes_done / elapsed if elapsed else 0.0
+        # The final report gives the rate of the whole scan, rather than of the last few blocks
+        current_rate = average_rate
+        if interval and not final:
+            current_rate = (self.bytes_done - self._last_bytes) / interval
+        remaining = max(self.total_bytes - self.bytes_done, 0)
+        eta = remaining / average_rate if average_rate else None
+        self._last_report = now
+        self._last_bytes = self.bytes_done
+
+        progress = {
+            'percent': round(100 * self.bytes_done / self.total_bytes, 1) if self.total_bytes else 100.0,
+            'bytes_scanned': self.bytes_done,
+            'total_bytes': self.total_bytes,
+            'blocks_scanned': self.blocks_done,
+            'mb_per_second': round(current_rate / (1024 * 1024), 1),
+            'matches': self.matches,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(elapsed, 1)
+        }
+        if self.status_line:
+            self._draw(progress)
+        else:
+            self.log_handler.log('PROGRESS', progress)
+
+    def _draw(self, progress: dict) -> None:
+        if not self.stream.isatty():
+            return
+        eta = progress['eta_seconds']
+        line = (f'[-] Scanned {progress["percent"]:.1f}% at {progress["mb_per_second"]:.1f} MB/s,'
+                f' {progress["matches"]} matches,'
+                f' ETA {timedelta(seconds=round(eta)) if eta is not None else "unknown"}')
+        self.stream.write('\r' + line.ljust(self._line_width))
+        self.stream.flush()
+        self._line_width = len(line)
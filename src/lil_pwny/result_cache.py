@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+from typing import Dict, Iterable, Optional, Tuple, List
+
+CACHE_VERSION = 1
+# Size of each chunk read from the start, middle and end of the source file to fingerprint its content
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+
+def source_fingerprint(filepath: str) -> str:
+    """ Fingerprint a hash file by its size, modification time and a hash of chunks from its start, middle and end.
+    Hashing the whole of a multi-GB HIBP file on every run would cost as much as scanning it
+
+    Args:
+        filepath: Path to the hash file
+    Returns:
+        Hex fingerprint of the file
+    """
+
+    stat = os.stat(filepath)
+    fingerprint = hashlib.sha256(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    with open(filepath, 'rb') as f:
+        for offset in [0, stat.st_size // 2, max(stat.st_size - FINGERPRINT_SAMPLE_SIZE, 0)]:
+            f.seek(offset)
+            fingerprint.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+    return fingerprint.hexdigest()
+
+
+class ResultCache:
+    """ On-disk cache of the HIBP verdict for each NTLM hash that has been checked against a given HIBP file.
+
+    Hashes are stored as salted SHA-256 fingerprints rather than the NTLM hashes themselves. The verdict is the number
+    of occurrences in HIBP, or None if the hash was not found. The cache is keyed by the fingerprint of the HIBP file,
+    so it is only reused against the same HIBP release.
+    """
+
+    def __init__(self, cache_dir: str, source_filepath: str):
+        self.source_fingerprint = source_fingerprint(source_filepath)
+        self.filepath = os.path.join(cache_dir, f'hibp-{self.source_fingerprint[:32]}.json')
+        self.salt = secrets.token_hex(16)
+        self.verdicts = {}
+        self._modified = False
+
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == CACHE_VERSION and data.get('source') == self.source_fingerprint:
+                    self.salt = data['salt']
+                    self.verdicts = data['verdicts']
+            except (ValueError, KeyError, OSError):
+                # A corrupt cache is discarded and rebuilt
+                self.verdicts = {}
+
+    def __len__(self) -> int:
+        return len(self.verdicts)
+
+    def _fingerprint(self, ntlm_hash: str) -> str:
+        return hashlib.sha256(f'{self.salt}:{ntlm_hash.upper()}'.encode('utf-8')).hexdigest()[:32]
+
+    def partition(self, ntlm_hashes: Iterable[str]) -> Tuple[Dict[str, Optional[str]], List[str]]:
+        """ Split hashes into those with a cached verdict and those that still need to be checked
+
+        Args:
+            ntlm_hashes: NTLM hashes to look up
+        Returns:
+            Dict of cached hashes to their verdict, and a list of the hashes that are not in the cache
+        """
+
+        cached = {}
+        uncached = []
+        for ntlm_hash in ntlm_hashes:
+            fingerprint = self._fingerprint(ntlm_hash)
+            if fingerprint in self.verdicts:
+                cached[ntlm_hash] = self.verdicts[fingerprint]
+            else:
+                uncached.append(ntlm_hash)
+        return cached, uncached
+
+    def update(self, verdicts: Dict[str, Optional[str]]) -> None:
+        """ Add verdicts to the cache
+
+        Args:
+            verdicts: Dict of NTLM hashes to the number of occurrences in HIBP, or None if not found
+        """
+
+        for ntlm_hash, verdict in verdicts.items():
+            self.verdicts[self._fingerprint(ntlm_hash)] = verdict
+        self._modified = self._modified or bool(verdicts)
+
+    def save(self) -> None:
+        """ Write the cache to disk, readable only by the current user
+        """
+
+        if not self._modified:
+            return
+        cache_dir = os.path.dirname(self.filepath)
+        os.makedirs(cache_dir, exist_ok=True)
+        data = {
+            'version': CACHE_VERSION,
+            'source': self.source_fingerprint,
+            'salt': self.salt,
+            'verdicts': self.verdicts
+        }
+        file_descriptor, temp_filepath = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_filepath, self.filepath)
+        except Exception:
+            os.remove(temp_filepath)
+            raise
+        self._modified = False
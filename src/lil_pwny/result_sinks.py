@@ -0,0 +1,142 @@
+import abc
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from typing import Dict, TextIO
+
+# Size in bytes of the write buffer of a results file
+SINK_BUFFER_SIZE = 1024 * 1024
+# Seconds between flushes of a results file, so it can be followed while the audit runs
+SINK_FLUSH_INTERVAL = 5
+# Columns of CSV results files. Lists, such as the users of a duplicate password, are joined with ;
+CSV_FIELDS = ['match_type', 'username', 'hash', 'matches_in_hibp', 'plaintext_password', 'obfuscated', 'source',
+              'users', 'sources']
+
+
+def _open_text(filepath: str, compress: bool, buffer_size: int) -> TextIO:
+    """ Open a file for writing text through a large write buffer, compressing it with gzip if required
+
+    Args:
+        filepath: path of the file
+        compress: whether to compress the file with gzip
+        buffer_size: size in bytes of the write buffer
+    Returns:
+        Text file object
+    """
+
+    if compress:
+        raw = gzip.GzipFile(filepath, 'wb')
+    else:
+        raw = io.FileIO(filepath, 'w')
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding='utf-8', newline='')
+
+
+class ResultSink(abc.ABC):
+    """ Streams findings to a results file as they are found, rather than collecting them to write at the end.
+
+    Findings are written through a large buffer, which is flushed every SINK_FLUSH_INTERVAL seconds and when the sink
+    is closed. Findings can be written from any thread.
+    """
+
+    def __init__(self,
+                 filepath: str,
+                 compress: bool = False,
+                 buffer_size: int = SINK_BUFFER_SIZE,
+                 flush_interval: float = SINK_FLUSH_INTERVAL):
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = _open_text(filepath, compress, buffer_size)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, finding_type: str, finding: Dict) -> None:
+        """ Write a finding to the results file
+
+        Args:
+            finding_type: type of finding, e.g. 'hibp' or 'duplicate'
+            finding: the finding
+        """
+
+        with self._lock:
+            self._write(finding_type, finding)
+            self.count += 1
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    @abc.abstractmethod
+    def _write(self, finding_type: str, finding: Dict) -> None:
+        """ Write a finding in the format of the sink. Called with the lock held
+
+        Args:
+            finding_type: type of finding
+            finding: the finding
+        """
+
+
+class NDJSONSink(ResultSink):
+    """ Writes each finding as a line of JSON, with its type in the match_type field
+    """
+
+    def _write(self, finding_type: str, finding: Dict) -> None:
+        self._file.write(json.dumps({'match_type': finding_type, **finding}))
+        self._file.write('\n')
+
+
+class CSVSink(ResultSink):
+    """ Writes each finding as a row of CSV, with the columns in CSV_FIELDS
+    """
+
+    def __init__(self, filepath: str, **kwargs):
+        super().__init__(filepath, **kwargs)
+        self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def _write(self, finding_type: str, finding: Dict) -> None:
+        row = {'match_type': finding_type, **finding}
+        for field in ['users', 'sources']:
+            if isinstance(row.get(field), list):
+                row[field] = ';'.join(row[field])
+        self._writer.writerow(row)
+
+
+SINK_FORMATS = {
+    '.ndjson': NDJSONSink,
+    '.jsonl': NDJSONSink,
+    '.csv': CSVSink
+}
+
+
+def open_sink(filepath: str) -> ResultSink:
+    """ Open a results file for streaming findings to, in the format given by its extension. Files ending in .gz are
+    compressed with gzip
+
+    Args:
+        filepath: path of the results file, e.g. results.ndjson, results.jsonl, results.csv or results.csv.gz
+    Returns:
+        NDJSONSink or CSVSink
+    """
+
+    compress = filepath.lower().endswith('.gz')
+    extension = os.path.splitext(filepath[:-3] if compress else filepath)[1].lower()
+    if extension not in SINK_FORMATS:
+        raise ValueError(f'Results file must end in {", ".join(SINK_FORMATS)}, optionally followed by .gz:'
+                         f' {filepath}')
+    return SINK_FORMATS[extension](filepath, compress=compress)
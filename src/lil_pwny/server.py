@@ -0,0 +1,159 @@
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+from typing import Iterable, TextIO
+
+from lil_pwny import hibp_index, password_audit
+from lil_pwny.loggers import JSONLogger, StdoutLogger
+
+PROTOCOL_VERSION = 2
+
+
+def open_index(hibp_filepath: str) -> hibp_index.HIBPIndex or password_audit.SortedHashFile:
+    """ Open a HIBP file for repeated lookups. This must be either a binary index created with `lil-pwny index build`
+    or a text file ordered by hash
+
+    Args:
+        hibp_filepath: Path to the HIBP file
+    Returns:
+        HIBPIndex or SortedHashFile
+    """
+
+    if hibp_index.is_index(hibp_filepath):
+        return hibp_index.HIBPIndex(hibp_filepath)
+    try:
+        return password_audit.SortedHashFile(hibp_filepath)
+    except ValueError:
+        raise ValueError(f'{hibp_filepath} is not ordered by hash. Convert it with `lil-pwny index build` to serve it')
+
+
+class AuditRequestHandler(socketserver.StreamRequestHandler):
+    """ Handles a single audit job. The client sends a JSON header line, then AD user lines in the same formats as the
+    AD user file, then closes its side of the connection. Findings are written back as JSONLogger records, followed
+    by a status record, either {"status": "ok"} or {"status": "error", "message": ...}
+    """
+
+    def handle(self):
+        output = io.TextIOWrapper(self.wfile, encoding='utf-8')
+        job_logger = JSONLogger(stream=output)
+        status = {'status': 'ok'}
+        try:
+            header = json.loads(self.rfile.readline() or b'{}')
+            if header.get('version') != PROTOCOL_VERSION:
+                raise ValueError(f'Unsupported protocol version {header.get("version")}')
+            obfuscated = bool(header.get('obfuscate'))
+
+            ad_users = password_audit.parse_users(line.decode('utf-8') for line in self.rfile)
+            ad_lines = sum(len(users) for users in ad_users.values())
+            results = password_audit.search_index(
+                log_handler=job_logger,
+                index=self.server.index,
+                ad_user_hashes=ad_users,
+                finding_type='hibp',
+                obfuscated=obfuscated)
+            for match in results:
+                job_logger.log('NOTIFY', match, notify_type='hibp')
+            job_logger.log('SUCCESS', f'Passwords matching HIBP: {len(results)}')
+            self.server.log_handler.log('INFO', f'Audited {ad_lines} AD users, {len(results)} matching HIBP')
+        except Exception as e:
+            job_logger.log('CRITICAL', f'Error during audit job: {str(e)}')
+            self.server.log_handler.log('ERROR', f'Error during audit job: {str(e)}')
+            status = {'status': 'error', 'message': str(e)}
+        finally:
+            output.write(json.dumps(status) + '\n')
+            output.flush()
+            output.detach()
+
+
+class AuditServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Unix socket server that keeps a HIBP index open and runs audit jobs against it
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 socket_path: str,
+                 index: hibp_index.HIBPIndex or password_audit.SortedHashFile,
+                 log_handler: JSONLogger or StdoutLogger):
+        self.index = index
+        self.log_handler = log_handler
+        # Only the user running the server can connect to the socket
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, AuditRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+
+def serve(hibp_filepath: str, socket_path: str, log_handler: JSONLogger or StdoutLogger) -> None:
+    """ Open the HIBP file once and serve audit jobs on a Unix socket until interrupted
+
+    Args:
+        hibp_filepath: Path to a binary HIBP index or a text HIBP file ordered by hash
+        socket_path: Path of the Unix socket to listen on
+        log_handler: logger instance for outputting
+    """
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Unix sockets are not supported on this platform')
+
+    # Remove a socket left behind by a server that did not shut down cleanly
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.remove(socket_path)
+
+    with open_index(hibp_filepath) as index:
+        with AuditServer(socket_path, index, log_handler) as server:
+            log_handler.log('SUCCESS', f'Serving {hibp_filepath} on {socket_path}')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                log_handler.log('INFO', 'Shutting down')
+            finally:
+                os.remove(socket_path)
+
+
+def submit_job(socket_path: str, ad_lines: Iterable[str], obfuscate: bool, output: TextIO) -> bool:
+    """ Send AD users to a running server and write the records it returns. The status record that ends the
+    response is not written
+
+    Args:
+        socket_path: Path of the Unix socket the server is listening on
+        ad_lines: Lines of AD user data, in the same formats as the AD user file
+        obfuscate: Whether to obfuscate hashes in the findings
+        output: Stream to write the findings to
+    Returns:
+        True if the server reported that the job succeeded, otherwise False
+    """
+
+    # The response is held back a line at a time, as the last line is the status record
+    last_line = None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('wb') as request:
+            request.write(json.dumps({'version': PROTOCOL_VERSION, 'obfuscate': obfuscate}).encode('utf-8') + b'\n')
+            for line in ad_lines:
+                request.write(line.rstrip('\r\n').encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+
+        with sock.makefile('rb') as response:
+            for line in response:
+                if last_line is not None:
+                    output.write(last_line.decode('utf-8'))
+                last_line = line
+
+    status = {}
+    if last_line is not None:
+        try:
+            status = json.loads(last_line)
+        except json.JSONDecodeError:
+            pass
+        if not isinstance(status, dict) or 'status' not in status:
+            # The connection closed before the status record was sent
+            output.write(last_line.decode('utf-8'))
+            status = {}
+    output.flush()
+    return status.get('status') == 'ok'
@@ -0,0 +1,120 @@
+import bisect
+import hashlib
+import os
+import struct
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+CACHE_VERSION = 1
+DIGEST_SIZE = 16
+# Records: raw 16 byte NTLM digest of a variant followed by its position in the order the variants are generated
+ORDINAL_FORMAT = '<I'
+RECORD_SIZE = DIGEST_SIZE + struct.calcsize(ORDINAL_FORMAT)
+
+
+class _DigestView:
+    """ Sequence of the digests in a block of sorted records, so they can be searched with bisect
+    """
+
+    def __init__(self, records: bytes):
+        self.records = records
+
+    def __len__(self) -> int:
+        return len(self.records) // RECORD_SIZE
+
+    def __getitem__(self, index: int) -> bytes:
+        offset = index * RECORD_SIZE
+        return self.records[offset:offset + DIGEST_SIZE]
+
+
+class VariantHashCache:
+    """ On-disk cache of the NTLM digests of the enhanced variants of custom passwords.
+
+    Each custom password has its own file of records sorted by digest, so an audit can check the AD hashes against
+    the cached variants without generating or hashing them. The position of each variant is stored with its digest,
+    so the plaintext of a match can be regenerated without hashing. Files are keyed by the custom password, the
+    generator settings and the version of Lil Pwny, so changing any of them generates the variants again.
+    """
+
+    def __init__(self, cache_dir: str, min_password_length: int, tool_version: str):
+        self.cache_dir = cache_dir
+        self.min_password_length = min_password_length
+        self.tool_version = tool_version
+
+    def filepath(self, password: str) -> str:
+        """ Path of the cache file for the variants of a custom password
+
+        Args:
+            password: The custom password
+        Returns:
+            Path of the cache file
+        """
+
+        key = hashlib.sha256(
+            f'{CACHE_VERSION}:{self.tool_version}:{self.min_password_length}:{datetime.now().year}:{password}'
+            .encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'variants-{key[:32]}.bin')
+
+    def lookup(self, password: str, ad_digests: Iterable[bytes]) -> Optional[Dict[bytes, int]]:
+        """ Find which AD hashes match a cached variant of a custom password
+
+        Args:
+            password: The custom password
+            ad_digests: raw digests of the AD user hashes
+        Returns:
+            Dict of each matching AD digest to the position of its variant, or None if the password is not cached
+        """
+
+        try:
+            with open(self.filepath(password), 'rb') as f:
+                records = f.read()
+        except FileNotFoundError:
+            return None
+        if len(records) % RECORD_SIZE:
+            return None
+
+        digests = _DigestView(records)
+        matches = {}
+        low = 0
+        # The AD digests are searched in order, so each search starts where the last one finished
+        for digest in sorted(ad_digests):
+            low = bisect.bisect_left(digests, digest, low)
+            if low == len(digests):
+                break
+            if digests[low] == digest:
+                offset = low * RECORD_SIZE + DIGEST_SIZE
+                matches[digest] = struct.unpack_from(ORDINAL_FORMAT, records, offset)[0]
+        return matches
+
+    def variant_count(self, password: str) -> int:
+        """ Number of variants cached for a custom password
+
+        Args:
+            password: The custom password
+        Returns:
+            Number of cached variants
+        """
+
+        return os.path.getsize(self.filepath(password)) // RECORD_SIZE
+
+    def store(self, password: str, digests: bytes) -> None:
+        """ Write the digests of the variants of a custom password to the cache, readable only by the current user
+
+        Args:
+            password: The custom password
+            digests: concatenated 16 byte digests of the variants, in the order they were generated
+        """
+
+        records = sorted(digests[offset:offset + DIGEST_SIZE] + struct.pack(ORDINAL_FORMAT, ordinal)
+                         for ordinal, offset in enumerate(range(0, len(digests), DIGEST_SIZE)))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_descriptor, temp_filepath = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                f.write(b''.join(records))
+            os.replace(temp_filepath, self.filepath(password))
+        except Exception:
+            os.remove(temp_filepath)
+            raise
@@ -1,6 +1,11 @@
-from typing import List
+from typing import Iterator, List, Set
 from datetime import datetime
 
+# Number of variants yielded at a time by generate_variants
+VARIANT_CHUNK_SIZE = 100000
+FIRST_YEAR = 1950
+SPECIAL_CHARACTERS = ['!', '@', '#', '$', '%', '&', '*', '?']
+
 
 class CustomVariantGenerator:
     """ Enhances the custom password with additional variations
@@ -9,18 +14,6 @@ class CustomVariantGenerator:
     def __init__(self, min_password_length: int = 8):
         self.min_password_length = min_password_length
 
-    def _deduplicate(self, password_list: List) -> List:
-        """ Remove duplicates from the given list
-        """
-
-        return list(set(password_list))
-
-    def _remove_too_short(self, password_list: List) -> List:
-        """ Remove passwords that do not match the length requirements
-        """
-
-        return [password for password in password_list if len(password) >= self.min_password_length]
-
     def _add_leet_speak(self, password: str) -> List[str]:
         """ Add leetspeak variations to a single password"""
 
@@ -78,21 +71,83 @@ class CustomVariantGenerator:
                 output_list.append(password + numeric_padding)
         return output_list
 
-    def _append_years(self, password_list: List) -> List:
-        """ Append years from 1950 to ten years greater than the current year to each password in the list
+    def _years(self) -> List[str]:
+        """ Years from 1950 to the current year, which are appended to each password
+        """
+
+        return [str(year) for year in range(FIRST_YEAR, datetime.now().year + 1)]
+
+    def _base_variants(self, password: str) -> Set[str]:
+        """ Generate the leetspeak, capitalised and padded variants of a password, which years and special characters
+        are then appended to
+
+        Args:
+            password: The custom password to enhance
+        Returns:
+            Set of base variants, including the password itself
+        """
+
+        variants = set(self._add_leet_speak(password))
+        variants.update(self._capitalise_first_character(list(variants)))
+        variants.update(self._pad_password(list(variants)))
+        return variants
+
+    def _stream_variants(self, base_variants: Set[str]) -> Iterator[str]:
+        """ Yield each base variant, and each base variant with a special character, a year, and a year followed by a
+        special character appended.
+
+        Only the base variants are held in memory. Variants shorter than the minimum length are dropped as they are
+        generated, and a suffixed variant that is itself a base variant is skipped as it is already yielded by that
+        base variant, so every variant is yielded exactly once. Variants are yielded in the same order on every run.
+
+        Args:
+            base_variants: Base variants from _base_variants
+        Returns:
+            Iterator of unique variants that meet the minimum length
         """
 
-        current_year = datetime.now().year
-        end_year = current_year
-        years = [str(year) for year in range(1950, end_year + 1)]
-        return [password + year for password in password_list for year in years]
+        years = self._years()
+        # Sorted so that variants are always generated in the same order, which VariantHashCache relies on
+        for password in sorted(base_variants):
+            if len(password) >= self.min_password_length:
+                yield password
+            if len(password) + len(years[0]) + 1 < self.min_password_length:
+                continue
+
+            for char in SPECIAL_CHARACTERS:
+                with_char = password + char
+                if len(with_char) >= self.min_password_length and with_char not in base_variants:
+                    yield with_char
+            for year in years:
+                with_year = password + year
+                if with_year in base_variants:
+                    continue
+                if len(with_year) >= self.min_password_length:
+                    yield with_year
+                for char in SPECIAL_CHARACTERS:
+                    with_year_char = with_year + char
+                    if len(with_year_char) >= self.min_password_length and with_year_char not in base_variants:
+                        yield with_year_char
+
+    def generate_variants(self, password: str, chunk_size: int = VARIANT_CHUNK_SIZE) -> Iterator[List[str]]:
+        """ Lazily generate the enhanced variants of a password in chunks, so memory use does not grow with the number
+        of variants
 
-    def _append_special_characters(self, password_list: List) -> List:
-        """ Append special characters commonly used in passwords to the end of each password in the list
+        Args:
+            password: The custom password to enhance
+            chunk_size: Maximum number of variants in each chunk
+        Returns:
+            Iterator of lists of unique variants that meet the minimum length
         """
 
-        special_characters = ['!', '@', '#', '$', '%', '&', '*', '?']
-        return [password + char for password in password_list for char in special_characters]
+        chunk = []
+        for variant in self._stream_variants(self._base_variants(password)):
+            chunk.append(variant)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
     def enhance_password(self, password: str) -> List:
         """ Enhance a plaintext password list with additional variations
@@ -103,9 +158,4 @@ class CustomVariantGenerator:
             Enhanced list of passwords
         """
 
-        enhanced_list = self._add_leet_speak(password)
-        enhanced_list += self._capitalise_first_character(enhanced_list)
-        enhanced_list += self._pad_password(enhanced_list)
-        enhanced_list += self._append_years(enhanced_list)
-        enhanced_list += self._append_special_characters(enhanced_list)
-        return self._deduplicate(self._remove_too_short(enhanced_list))
+        return [variant for chunk in self.generate_variants(password) for variant in chunk]
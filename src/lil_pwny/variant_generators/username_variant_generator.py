@@ -1,10 +1,10 @@
-from typing import Dict, List
+from typing import List
 
 
 class UsernameVariantGenerator:
 
-    def generate_variations(self, ad_user_list: Dict[str, List[str]]) -> List[str]:
-        """ Generates variations of usernames based on specific rules.
+    def generate_user_variations(self, uname: str) -> List[str]:
+        """ Generates the variations of a single username, without duplicates.
             - All uppercase
             - All lowercase
             - Remove dot "."
@@ -12,30 +12,27 @@ class UsernameVariantGenerator:
             - PascalCase
 
         Args:
-            ad_user_list: A dictionary where keys are NTLM hashes and values are lists of usernames.
+            uname: The username to generate variations of.
         Returns:
-            List: A list of generated username variations.
+            List: A list of the unique variations of the username.
         """
 
         variations = []
+        if '.' in uname:
+            split_uname = uname.split('.')
 
-        for ntlm_hash, usernames in ad_user_list.items():
-            for uname in usernames:
-                if '.' in uname:
-                    split_uname = uname.split('.')
+            if len(split_uname) > 1:
+                camel_uname = split_uname[0].lower() + ''.join(part.capitalize() for part in split_uname[1:])
+                variations.append(camel_uname)
 
-                    if len(split_uname) > 1:
-                        camel_uname = split_uname[0].lower() + ''.join(part.capitalize() for part in split_uname[1:])
-                        variations.append(camel_uname)
+                pascal_uname = ''.join(part.capitalize() for part in split_uname)
+                variations.append(pascal_uname)
 
-                        pascal_uname = ''.join(part.capitalize() for part in split_uname)
-                        variations.append(pascal_uname)
+            stripped_uname = uname.replace('.', '')
+            variations.append(stripped_uname.upper())
+            variations.append(stripped_uname.lower())
 
-                    stripped_uname = uname.replace('.', '')
-                    variations.append(stripped_uname.upper())
-                    variations.append(stripped_uname.lower())
+        variations.append(uname.upper())
+        variations.append(uname.lower())
 
-                variations.append(uname.upper())
-                variations.append(uname.lower())
-
-        return variations
+        return list(dict.fromkeys(variations))
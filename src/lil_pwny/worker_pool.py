@@ -0,0 +1,65 @@
+import multiprocessing as mp
+from multiprocessing.pool import Pool
+from typing import Any
+
+# Barrier shared by the workers of a WorkerPool, set by the pool initializer
+_install_barrier = None
+
+
+def _init_pool_worker(barrier: Any) -> None:
+    """ Pool initializer that stores the barrier used to install state in every worker
+    """
+
+    global _install_barrier
+    _install_barrier = barrier
+
+
+def _install(function: callable, args: tuple) -> None:
+    """ Run a state initializer in a worker, then wait until every worker has run it. Waiting stops a worker from
+    taking a second install job, so each worker runs the initializer exactly once
+    """
+
+    try:
+        function(*args)
+    finally:
+        _install_barrier.wait()
+
+
+class WorkerPool(object):
+    """ Pool of worker processes shared by every check of an audit, so processes are only started once.
+
+    State used by every job of a check, such as the AD user hashes for a scan of the HIBP file, is installed in each
+    worker once with `install`, in the same way as a pool initializer, rather than being sent with each job. Jobs that
+    do not use installed state, such as hashing batches of passwords, can run in the pool alongside them.
+    """
+
+    def __init__(self, processes: int):
+        self.processes = max(processes, 1)
+        self._barrier = mp.Barrier(self.processes)
+        self.pool = Pool(self.processes, initializer=_init_pool_worker, initargs=(self._barrier,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    def install(self, function: callable, *args) -> None:
+        """ Run a state initializer, such as _init_worker, once in every worker process. Only one install can run at a
+        time
+
+        Args:
+            function: initializer to run in each worker
+            args: arguments for the initializer
+        """
+
+        results = [self.pool.apply_async(_install, (function, args)) for _ in range(self.processes)]
+        for result in results:
+            result.get()
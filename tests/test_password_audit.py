@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+from lil_pwny import password_audit
+from lil_pwny.exceptions import MalformedHIBPError
+from lil_pwny.hashing import ntlm_digests
+from lil_pwny.loggers import JSONLogger
+
+PASSWORDS = ['Password1', 'Summer2019!', 'letmein']
+
+
+def _ntlm_hash(password):
+    return ntlm_digests([password]).hex().upper()
+
+
+def _hibp_lines(count):
+    # Distinct hashes that do not belong to any AD user, in no particular order
+    return [f'{_ntlm_hash(f"unbreached{i}")}:{i + 1}' for i in range(count)]
+
+
+def _search(hibp_filepath, ad_user_hashes):
+    return password_audit.search(
+        log_handler=JSONLogger(stream=io.StringIO()),
+        hibp_hashes_filepath=str(hibp_filepath),
+        ad_user_hashes=ad_user_hashes,
+        finding_type='hibp',
+        obfuscated=False,
+        sorted_lookup=False,
+        workers=1,
+        engine='python')
+
+
+def test_python_engine_finds_matches(tmp_path):
+    ad_user_hashes = {_ntlm_hash(password): [f'USER{i}'] for i, password in enumerate(PASSWORDS)}
+    lines = _hibp_lines(100)
+    lines[50:50] = [f'{ntlm_hash}:7' for ntlm_hash in ad_user_hashes]
+    hibp_filepath = tmp_path / 'hibp.txt'
+    hibp_filepath.write_text('\n'.join(lines) + '\n')
+
+    results = _search(hibp_filepath, ad_user_hashes)
+
+    assert sorted(result['username'] for result in results) == ['USER0', 'USER1', 'USER2']
+    assert {result['matches_in_hibp'] for result in results} == {'7'}
+
+
+def test_python_engine_rejects_malformed_line_in_block(tmp_path):
+    ntlm_hash = _ntlm_hash(PASSWORDS[0])
+    lines = _hibp_lines(100)
+    # A truncated line in the middle of the block, whose prefix matches an AD hash
+    lines.insert(50, f'{ntlm_hash[:20]}:7')
+    hibp_filepath = tmp_path / 'hibp.txt'
+    hibp_filepath.write_text('\n'.join(lines) + '\n')
+
+    with pytest.raises(MalformedHIBPError):
+        _search(hibp_filepath, {ntlm_hash: ['USER0']})
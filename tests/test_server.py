@@ -0,0 +1,55 @@
+import io
+import json
+import threading
+
+import pytest
+
+from lil_pwny import server
+from lil_pwny.hashing import ntlm_digests
+from lil_pwny.loggers import JSONLogger
+
+PASSWORDS = ['Password1', 'Summer2019!', 'letmein']
+
+
+def _ntlm_hash(password):
+    return ntlm_digests([password]).hex().upper()
+
+
+@pytest.fixture
+def audit_server(tmp_path):
+    ntlm_hashes = sorted(_ntlm_hash(password) for password in PASSWORDS)
+    hibp_filepath = tmp_path / 'hibp.txt'
+    hibp_filepath.write_text(''.join(f'{ntlm_hash}:{count}\n' for count, ntlm_hash in enumerate(ntlm_hashes, 1)))
+    socket_path = str(tmp_path / 'lil-pwny.sock')
+
+    with server.open_index(str(hibp_filepath)) as index:
+        with server.AuditServer(socket_path, index, JSONLogger(stream=io.StringIO())) as audit:
+            thread = threading.Thread(target=audit.serve_forever, daemon=True)
+            thread.start()
+            yield socket_path
+            audit.shutdown()
+            thread.join()
+
+
+def _submit(socket_path, ad_lines):
+    output = io.StringIO()
+    succeeded = server.submit_job(socket_path, ad_lines, False, output)
+    return succeeded, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_job_findings_are_json(audit_server):
+    ad_lines = [f'user{i}:{_ntlm_hash(password)}' for i, password in enumerate(PASSWORDS + ['unbreached'])]
+
+    succeeded, records = _submit(audit_server, ad_lines)
+
+    assert succeeded
+    assert [record['level'] for record in records] == ['NOTIFY'] * len(PASSWORDS) + ['SUCCESS']
+    assert {record['detection_data']['username'] for record in records[:-1]} == {'USER0', 'USER1', 'USER2'}
+
+
+def test_failed_job_records_are_json(audit_server):
+    succeeded, records = _submit(audit_server, ['user0:B54736323E7CE8465A3025E110B078DA', 'malformed'])
+
+    assert not succeeded
+    assert records[-1]['level'] == 'CRITICAL'
+    assert 'Line 2 of the AD user file' in records[-1]['message']